@@ -1,17 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import sqlite3
-from datetime import date, datetime
+import threading
+import functools
+import cProfile
+import pstats
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 import time
 import io
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import re
 import hashlib
 import logging
+import os
 from fpdf import FPDF
 from streamlit_option_menu import option_menu
 from typing import Optional, List, Any, Dict
-from pydantic import BaseModel, Field, validator, ValidationError
+from pydantic import BaseModel, Field, validator, ValidationError, TypeAdapter
 import base64
 
 st.set_page_config(
@@ -178,15 +190,32 @@ logging.basicConfig(filename='system.log', level=logging.INFO, format='%(asctime
 def log_activity(u, a, d): 
     logging.info(f"{u}|{a}|{d}")
 
+# Query lambat dicatat terpisah dari system.log; batasnya bisa diubah lewat env atau panel Performance.
+SLOW_QUERY_MS = float(os.environ.get("HASNA_SLOW_QUERY_MS", "250"))
+slow_query_log = logging.getLogger("hasna.slow_query")
+if not slow_query_log.handlers:
+    _h = logging.FileHandler(os.environ.get("HASNA_SLOW_QUERY_LOG", "slow_query.log"))
+    _h.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_query_log.addHandler(_h)
+    slow_query_log.setLevel(logging.INFO)
+    slow_query_log.propagate = False
+
+# Halaman yang sedang dirender di thread ini (diisi decorator profiled), untuk atribusi query & profil render.
+page_context = threading.local()
+
 def make_hash(pw): 
     return hashlib.sha256(str.encode(pw)).hexdigest()
 
+def rupiah(x):
+    # Uang disimpan sebagai integer rupiah (tanpa sen).
+    return int(round(float(x or 0)))
+
 class JurnalSchema(BaseModel):
     tanggal: date
     deskripsi: str = Field(..., min_length=3)
     akun_debit: str
     akun_kredit: str
-    nominal: float = Field(..., gt=0)
+    nominal: int = Field(..., gt=0)
     created_by: str
     
     @validator('akun_kredit')
@@ -195,136 +224,1300 @@ class JurnalSchema(BaseModel):
             raise ValueError("Akun Debit dan Kredit tidak boleh sama!")
         return v
 
-class DatabaseManager:
-    def __init__(self, db_name): 
+SQL_INSERT_JURNAL = "INSERT INTO jurnal (tanggal, deskripsi, akun_debit, akun_kredit, nominal, created_by, jenis) VALUES (?,?,?,?,?,?,?)"
+SQL_INSERT_STOCK_LOG = "INSERT INTO stock_log (tanggal, kode_barang, jenis_gerak, jumlah, harga_satuan, keterangan, user) VALUES (?,?,?,?,?,?,?)"
+
+# Filter lewat akun_id (index akun+tanggal), nama akun baru di-join untuk baris yang lolos
+# (CROSS JOIN = urutan join dikunci: jurnal_data dulu). INDEXED BY: dengan sqlite_stat1 planner
+# bisa memilih idx_jurnal_tanggal (range seluruh periode, filter akun belakangan) demi ORDER BY.
+SQL_LEDGER = """
+    SELECT j.id, j.tanggal, j.deskripsi, d.nama_akun AS akun_debit, k.nama_akun AS akun_kredit,
+           j.nominal, j.created_at, j.created_by, j.jenis
+    FROM (
+        SELECT * FROM jurnal_data INDEXED BY idx_jurnal_debit
+        WHERE akun_debit_id=(SELECT id FROM akun WHERE nama_akun=?) AND tanggal BETWEEN ? AND ?
+        UNION ALL
+        SELECT * FROM jurnal_data INDEXED BY idx_jurnal_kredit
+        WHERE akun_kredit_id=(SELECT id FROM akun WHERE nama_akun=?) AND tanggal BETWEEN ? AND ?
+            AND akun_debit_id IS NOT (SELECT id FROM akun WHERE nama_akun=?)
+    ) j CROSS JOIN akun d ON d.id = j.akun_debit_id CROSS JOIN akun k ON k.id = j.akun_kredit_id
+    ORDER BY j.tanggal ASC, j.id ASC
+"""
+# Versi ekspor: debit/kredit per baris + saldo berjalan via window function, dibaca per chunk.
+SQL_LEDGER_EXPORT = """
+    SELECT j.id, j.tanggal, j.deskripsi, l.nama_akun AS akun_lawan,
+           CASE WHEN j.akun_debit_id = j.acc_id THEN j.nominal ELSE 0 END AS debit,
+           CASE WHEN j.akun_debit_id = j.acc_id THEN 0 ELSE j.nominal END AS kredit,
+           :awal + :arah * SUM(CASE WHEN j.akun_debit_id = j.acc_id THEN j.nominal ELSE -j.nominal END)
+               OVER (ORDER BY j.tanggal, j.id ROWS UNBOUNDED PRECEDING) AS saldo
+    FROM (
+        SELECT *, akun_debit_id AS acc_id, akun_kredit_id AS lawan_id FROM jurnal_data INDEXED BY idx_jurnal_debit
+        WHERE akun_debit_id = (SELECT id FROM akun WHERE nama_akun = :acc) AND tanggal BETWEEN :dari AND :sampai
+        UNION ALL
+        SELECT *, akun_kredit_id, akun_debit_id FROM jurnal_data INDEXED BY idx_jurnal_kredit
+        WHERE akun_kredit_id = (SELECT id FROM akun WHERE nama_akun = :acc) AND tanggal BETWEEN :dari AND :sampai
+            AND akun_debit_id IS NOT (SELECT id FROM akun WHERE nama_akun = :acc)
+    ) j CROSS JOIN akun l ON l.id = j.lawan_id
+    ORDER BY j.tanggal ASC, j.id ASC
+"""
+SQL_STOCK_CARD = "SELECT * FROM stock_log WHERE kode_barang=? ORDER BY tanggal ASC, id ASC"
+# Pencarian teks: hasil diurutkan bm25 (rank), lalu transaksi terbaru.
+SQL_SEARCH_JURNAL = """
+    SELECT j.id, j.tanggal, j.deskripsi, j.akun_debit, j.akun_kredit, j.nominal
+    FROM jurnal_fts f JOIN jurnal j ON j.id = f.rowid
+    WHERE jurnal_fts MATCH ? ORDER BY f.rank, j.tanggal DESC, j.id DESC LIMIT ? OFFSET ?
+"""
+SQL_SEARCH_STOCK_LOG = """
+    SELECT s.id, s.tanggal, s.keterangan, s.kode_barang, s.jenis_gerak, s.jumlah, s.harga_satuan
+    FROM stock_log_fts f JOIN stock_log s ON s.id = f.rowid
+    WHERE stock_log_fts MATCH ? ORDER BY f.rank, s.tanggal DESC, s.id DESC LIMIT ? OFFSET ?
+"""
+SQL_SEARCH_COUNT = "SELECT COUNT(*) FROM {fts} WHERE {fts} MATCH ?"
+SEARCH_PAGE_SIZE = 20
+
+def fts_query(text):
+    # Input bebas -> query FTS5 aman: tiap kata jadi prefix term, digabung AND.
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words)
+
+# Rollup jurnal per periode: grain -> panjang prefix tanggal (YYYY-MM-DD / YYYY-MM / YYYY).
+ROLLUP_GRAINS = {"harian": 10, "bulanan": 7, "tahunan": 4}
+ROLLUP_GRAIN_ROWS = " UNION ALL ".join(f"SELECT '{g}' AS grain, {n} AS n" for g, n in ROLLUP_GRAINS.items())
+# Jurnal penutup (tutup buku) hanya memindahkan saldo nominal ke modal, bukan pendapatan/beban periode:
+# tidak ikut rollup, sama seperti laba rugi yang mengeluarkannya lewat SQL_CLOSING_TOTALS.
+ROLLUP_FILTER = "{row}jenis IS NOT 'PENUTUP'"
+SQL_ROLLUP_TOTALS = f"""
+    SELECT g.grain, substr(j.tanggal, 1, g.n) AS periode, j.akun_id, j.sisi, SUM(j.nominal), COUNT(*)
+    FROM (
+        SELECT tanggal, akun_debit_id AS akun_id, 'D' AS sisi, nominal FROM jurnal_data
+        WHERE akun_debit_id IS NOT NULL AND tanggal IS NOT NULL AND {ROLLUP_FILTER.format(row="")}
+        UNION ALL
+        SELECT tanggal, akun_kredit_id, 'K', nominal FROM jurnal_data
+        WHERE akun_kredit_id IS NOT NULL AND tanggal IS NOT NULL AND {ROLLUP_FILTER.format(row="")}
+    ) j CROSS JOIN ({ROLLUP_GRAIN_ROWS}) g
+    GROUP BY 1, 2, 3, 4
+"""
+# Arus kas dashboard dari rollup: kredit akun Pendapatan = pemasukan, debit akun Beban = pengeluaran.
+SQL_DASH_CASHFLOW = """
+    SELECT r.periode, SUM(r.nominal) AS nominal, CASE r.sisi WHEN 'K' THEN 'Pemasukan' ELSE 'Pengeluaran' END AS Type
+    FROM jurnal_rollup r JOIN akun a ON a.id = r.akun_id
+    WHERE r.grain = ? AND ((r.sisi = 'K' AND a.tipe_akun = 'Pendapatan') OR (r.sisi = 'D' AND a.tipe_akun = 'Beban'))
+    GROUP BY r.periode, Type
+    ORDER BY Type, r.periode
+"""
+SQL_DASH_EXPENSE = """
+    SELECT a.nama_akun AS akun_debit, SUM(r.nominal) AS nominal
+    FROM jurnal_rollup r JOIN akun a ON a.id = r.akun_id
+    WHERE r.grain = 'tahunan' AND r.sisi = 'D' AND a.tipe_akun = 'Beban'
+    GROUP BY r.akun_id
+    ORDER BY a.nama_akun
+"""
+SQL_JURNAL_RECENT = "SELECT * FROM jurnal ORDER BY tanggal DESC, id DESC LIMIT 50"
+# Keyset: halaman dimulai tepat setelah kursor (tanggal, id) -> selalu index seek, tanpa OFFSET.
+SQL_JURNAL_PAGE = "SELECT * FROM jurnal WHERE {filt}(tanggal, id) < (?, ?) ORDER BY tanggal DESC, id DESC LIMIT ?"
+SQL_JURNAL_EXPORT = "SELECT * FROM jurnal WHERE {filt}1 ORDER BY tanggal ASC, id ASC"
+SQL_JURNAL_NEWER = "SELECT tanggal, id FROM jurnal WHERE {filt}(tanggal, id) >= (?, ?) ORDER BY tanggal ASC, id ASC LIMIT ?"
+SQL_STOCK_LOG_RECENT = "SELECT * FROM stock_log ORDER BY tanggal DESC, id DESC LIMIT 50"
+SQL_RECEIPTS_RANGE = "SELECT id, tanggal, deskripsi, nominal, akun_debit, akun_kredit FROM jurnal WHERE {filt}tanggal BETWEEN ? AND ? ORDER BY tanggal, id"
+# Daftar ID dikirim sebagai satu array JSON, bukan ratusan placeholder.
+SQL_RECEIPTS_IDS = "SELECT id, tanggal, deskripsi, nominal, akun_debit, akun_kredit FROM jurnal WHERE id IN (SELECT value FROM json_each(?)) ORDER BY tanggal, id"
+
+SQL_ACCOUNT_BALANCES = """
+    SELECT a.kode_akun, a.nama_akun, a.tipe_akun,
+           COALESCE(b.debit, 0) AS debit, COALESCE(b.kredit, 0) AS kredit
+    FROM akun a
+    LEFT JOIN account_balance b ON b.akun_id = a.id
+    ORDER BY a.kode_akun
+"""
+# Agregasi penuh dari jurnal; dipakai untuk rebuild & cek konsistensi account_balance.
+SQL_JURNAL_TOTALS = """
+    SELECT akun_id, SUM(debit) AS debit, SUM(kredit) AS kredit FROM (
+        SELECT akun_debit_id AS akun_id, nominal AS debit, 0 AS kredit FROM jurnal_data
+        UNION ALL
+        SELECT akun_kredit_id AS akun_id, 0 AS debit, nominal AS kredit FROM jurnal_data
+    ) WHERE akun_id IS NOT NULL GROUP BY akun_id
+"""
+
+# Saldo kumulatif per akun per hari: saldo per tanggal = dua lookup index per akun.
+SQL_DAILY_TOTALS = """
+    SELECT akun_id, tanggal, d AS debit, k AS kredit,
+           SUM(d) OVER w AS cum_debit, SUM(k) OVER w AS cum_kredit
+    FROM (
+        SELECT akun_id, tanggal, SUM(debit) AS d, SUM(kredit) AS k FROM (
+            SELECT akun_debit_id AS akun_id, tanggal, nominal AS debit, 0 AS kredit FROM jurnal_data
+            UNION ALL
+            SELECT akun_kredit_id AS akun_id, tanggal, 0 AS debit, nominal AS kredit FROM jurnal_data
+        ) WHERE akun_id IS NOT NULL AND tanggal IS NOT NULL GROUP BY akun_id, tanggal
+    )
+    WINDOW w AS (PARTITION BY akun_id ORDER BY tanggal)
+"""
+
+# Versi lama (tabel turunan dikunci nama akun); hanya dipakai migrasi sebelum migration_akun_id.
+SQL_JURNAL_TOTALS_NAMA = """
+    SELECT nama_akun, SUM(debit) AS debit, SUM(kredit) AS kredit FROM (
+        SELECT akun_debit AS nama_akun, nominal AS debit, 0 AS kredit FROM jurnal
+        UNION ALL
+        SELECT akun_kredit AS nama_akun, 0 AS debit, nominal AS kredit FROM jurnal
+    ) WHERE nama_akun IS NOT NULL GROUP BY nama_akun
+"""
+SQL_DAILY_TOTALS_NAMA = """
+    SELECT nama_akun, tanggal, d AS debit, k AS kredit,
+           SUM(d) OVER w AS cum_debit, SUM(k) OVER w AS cum_kredit
+    FROM (
+        SELECT nama_akun, tanggal, SUM(debit) AS d, SUM(kredit) AS k FROM (
+            SELECT akun_debit AS nama_akun, tanggal, nominal AS debit, 0 AS kredit FROM jurnal
+            UNION ALL
+            SELECT akun_kredit AS nama_akun, tanggal, 0 AS debit, nominal AS kredit FROM jurnal
+        ) WHERE nama_akun IS NOT NULL AND tanggal IS NOT NULL GROUP BY nama_akun, tanggal
+    )
+    WINDOW w AS (PARTITION BY nama_akun ORDER BY tanggal)
+"""
+SQL_ROLLUP_TOTALS_NAMA = f"""
+    SELECT g.grain, substr(j.tanggal, 1, g.n) AS periode, j.nama_akun, j.sisi, SUM(j.nominal), COUNT(*)
+    FROM (
+        SELECT tanggal, akun_debit AS nama_akun, 'D' AS sisi, nominal FROM jurnal WHERE akun_debit IS NOT NULL AND tanggal IS NOT NULL
+        UNION ALL
+        SELECT tanggal, akun_kredit, 'K', nominal FROM jurnal WHERE akun_kredit IS NOT NULL AND tanggal IS NOT NULL
+    ) j CROSS JOIN ({ROLLUP_GRAIN_ROWS}) g
+    GROUP BY 1, 2, 3, 4
+"""
+SQL_BALANCES_ASOF = """
+    SELECT a.kode_akun, a.nama_akun, a.tipe_akun,
+           COALESCE((SELECT s.cum_debit FROM account_daily_balance s
+                     WHERE s.akun_id = a.id AND s.tanggal {op} ? ORDER BY s.tanggal DESC LIMIT 1), 0) AS debit,
+           COALESCE((SELECT s.cum_kredit FROM account_daily_balance s
+                     WHERE s.akun_id = a.id AND s.tanggal {op} ? ORDER BY s.tanggal DESC LIMIT 1), 0) AS kredit
+    FROM akun a
+    ORDER BY a.kode_akun
+"""
+SQL_BALANCES_UNTIL = SQL_BALANCES_ASOF.format(op="<=")
+SQL_BALANCES_BEFORE = SQL_BALANCES_ASOF.format(op="<")
+
+# Tutup buku: saldo akhir per akun disimpan per tanggal tutup = saldo awal periode berikutnya.
+TIPE_NOMINAL = ("Pendapatan", "Beban", "HPP")
+SQL_SALDO_TUTUP_SNAPSHOT = f"""
+    INSERT INTO saldo_tutup (sampai, akun_id, debit, kredit)
+    SELECT ?, a.id, b.debit, b.kredit FROM ({SQL_BALANCES_UNTIL}) b JOIN akun a ON a.kode_akun = b.kode_akun
+    WHERE b.debit <> 0 OR b.kredit <> 0
+"""
+SQL_SALDO_TUTUP = """
+    SELECT a.kode_akun, a.nama_akun, a.tipe_akun, COALESCE(s.debit, 0) AS debit, COALESCE(s.kredit, 0) AS kredit
+    FROM akun a LEFT JOIN saldo_tutup s ON s.akun_id = a.id AND s.sampai = ?
+    ORDER BY a.kode_akun
+"""
+# Mutasi jurnal penutup dalam rentang; dikeluarkan dari laba rugi agar periode yang melewati tanggal tutup tidak nol.
+SQL_CLOSING_TOTALS = """
+    SELECT a.kode_akun,
+           COALESCE(SUM(CASE WHEN j.akun_debit_id = a.id THEN j.nominal END), 0) AS debit,
+           COALESCE(SUM(CASE WHEN j.akun_kredit_id = a.id THEN j.nominal END), 0) AS kredit
+    FROM akun a
+    LEFT JOIN jurnal_data j ON j.jenis = 'PENUTUP' AND j.tanggal BETWEEN ? AND ? AND a.id IN (j.akun_debit_id, j.akun_kredit_id)
+    GROUP BY a.kode_akun, a.id
+    ORDER BY a.kode_akun
+"""
+SQL_CLOSING_DATES = "SELECT sampai FROM periode_tutup ORDER BY sampai"
+
+# Lookup satu akun / satu barang.
+SQL_BALANCE_AKUN = "SELECT debit - kredit FROM account_balance WHERE akun_id=(SELECT id FROM akun WHERE nama_akun=?)"
+SQL_SALDO_TUTUP_AKUN = "SELECT debit, kredit FROM saldo_tutup WHERE sampai=? AND akun_id=(SELECT id FROM akun WHERE nama_akun=?)"
+SQL_DAILY_BEFORE_AKUN = "SELECT cum_debit, cum_kredit FROM account_daily_balance WHERE akun_id=(SELECT id FROM akun WHERE nama_akun=?) AND tanggal<? ORDER BY tanggal DESC LIMIT 1"
+SQL_STD_COST = "SELECT std_cost FROM inventory WHERE kode_barang=?"
+SQL_DATE_MIN = "SELECT MIN(tanggal) FROM jurnal_data"
+SQL_DATE_MAX = "SELECT MAX(tanggal) FROM jurnal_data"
+SQL_ADA_JURNAL = "SELECT 1 FROM jurnal_data LIMIT 1"
+SQL_LOW_STOCK_COUNT = "SELECT COUNT(*) FROM inventory WHERE stok_saat_ini <= min_stok"
+
+# Isi tabel turunan per akun, dibandingkan dengan SQL_JURNAL_TOTALS di cek konsistensi.
+SQL_BALANCE_STORED = "SELECT akun_id, debit, kredit FROM account_balance"
+SQL_DAILY_LATEST = """
+    SELECT s.akun_id, s.cum_debit AS debit_harian, s.cum_kredit AS kredit_harian
+    FROM account_daily_balance s
+    WHERE s.tanggal = (SELECT MAX(tanggal) FROM account_daily_balance WHERE akun_id = s.akun_id)
+"""
+SQL_PENUTUP_TOTALS = """
+    SELECT akun_id, SUM(debit) AS debit_penutup, SUM(kredit) AS kredit_penutup FROM (
+        SELECT akun_debit_id AS akun_id, nominal AS debit, 0 AS kredit FROM jurnal_data WHERE jenis = 'PENUTUP'
+        UNION ALL
+        SELECT akun_kredit_id AS akun_id, 0 AS debit, nominal AS kredit FROM jurnal_data WHERE jenis = 'PENUTUP'
+    ) GROUP BY akun_id
+"""
+SQL_ROLLUP_YEAR_TOTALS = """
+    SELECT akun_id, SUM(CASE WHEN sisi = 'D' THEN nominal ELSE 0 END) AS debit_rollup,
+           SUM(CASE WHEN sisi = 'K' THEN nominal ELSE 0 END) AS kredit_rollup
+    FROM jurnal_rollup WHERE grain = 'tahunan' GROUP BY akun_id
+"""
+
+# Statement yang memang membaca semua baris: daftar per akun/barang, ekspor penuh,
+# agregasi untuk rebuild & cek konsistensi tabel turunan.
+FULL_SCAN_OK = {
+    SQL_ACCOUNT_BALANCES, SQL_BALANCES_UNTIL, SQL_BALANCES_BEFORE, SQL_SALDO_TUTUP, SQL_SALDO_TUTUP_SNAPSHOT,
+    SQL_CLOSING_TOTALS, SQL_CLOSING_DATES, SQL_LOW_STOCK_COUNT, SQL_JURNAL_EXPORT.format(filt=""),
+    SQL_JURNAL_TOTALS, SQL_DAILY_TOTALS, SQL_ROLLUP_TOTALS, SQL_BALANCE_STORED, SQL_DAILY_LATEST,
+}
+SQL_LIMIT_TAIL = re.compile(r"\bLIMIT\s+\S+(\s+OFFSET\s+\S+)?\s*$", re.I)
+
+def full_scans(plan, q=""):
+    # Baris EXPLAIN QUERY PLAN yang membaca seluruh tabel dasar: SCAN tanpa index, atau SCAN lewat
+    # index (urut index, tetap semua baris) bila statement tidak dibatasi LIMIT di ujungnya.
+    # Subquery/CTE (CO-ROUTINE/MATERIALIZE), virtual table (FTS, json_each) & baris konstan bukan tabel dasar.
+    if q in FULL_SCAN_OK:
+        return []
+    bounded = bool(SQL_LIMIT_TAIL.search(q)) and "USE TEMP B-TREE FOR ORDER BY" not in plan
+    subq = {d.split(" ", 1)[1] for d in plan if d.startswith(("CO-ROUTINE ", "MATERIALIZE "))}
+    return [d for d in plan if d.startswith("SCAN ") and " VIRTUAL TABLE" not in d and d != "SCAN CONSTANT ROW"
+            and d.split(" ")[1] not in subq and not d.startswith("SCAN (") and not (bounded and " INDEX " in d)]
+
+# Query yang jalan di setiap rerun; tidak boleh jatuh ke full table scan.
+HOT_QUERIES = {
+    "Buku Besar": (SQL_LEDGER, ("Kas", "2025-01-01", "2025-12-31", "Kas", "2025-01-01", "2025-12-31", "Kas")),
+    "Export Buku Besar": (SQL_LEDGER_EXPORT, {"acc": "Kas", "dari": "2025-01-01", "sampai": "2025-12-31", "awal": 0, "arah": 1}),
+    "Kartu Stok": (SQL_STOCK_CARD, ("TELUR",)),
+    "Riwayat Jurnal": (SQL_JURNAL_PAGE.format(filt=""), ("2025-06-30", 1 << 62, 51)),
+    "System Logs": (SQL_STOCK_LOG_RECENT, ()),
+    "Saldo Akun": (SQL_ACCOUNT_BALANCES, ()),
+    "Saldo per Tanggal": (SQL_BALANCES_UNTIL, ("2025-12-31", "2025-12-31")),
+}
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-32000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+class ConnectionPool:
+    # Satu koneksi per thread script Streamlit. Koneksi milik thread yang sudah
+    # selesai (rerun lama) dipakai ulang, bukan dibuka baru.
+    def __init__(self, db_name, cached_statements=256):
         self.db_name = db_name
-    
-    def _conn(self):
-        c = sqlite3.connect(self.db_name)
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._by_thread = {}
+        self._idle = []
+
+    def _open(self):
+        c = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=self.cached_statements)
         c.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS:
+            c.execute(pragma)
         return c
 
-    def get_inventory_card_df(self, kode_barang):
-        STD_COSTS = {"TELUR": 100000, "PUPUK": 6000, "PKN-MERAH": 360000, "PKN-BIRU": 435000, "VIT-OBAT": 250000}
-        logs = self.get_df("SELECT * FROM stock_log WHERE kode_barang=? ORDER BY tanggal ASC, id ASC", (kode_barang,))
-        std_price = STD_COSTS.get(kode_barang, 0)
-        data = []
-        running_qty = 0
-        
-        saldo_awal_log = logs[(logs['keterangan'].str.contains('Saldo Awal', case=False, na=False)) & (logs['jenis_gerak'] == 'IN')]
-        
-        def fmt(v): return f"{v:,.0f}" if v > 0 else ""
-        def fmt_rp(v): return f"Rp{v:,.0f}" if v > 0 else ""
-
-        if not saldo_awal_log.empty:
-            sa = saldo_awal_log.iloc[0]
-            running_qty = sa['jumlah']
-            data.append(["", "Saldo Awal", "", "", "", "", "", "", fmt(running_qty), fmt_rp(std_price), fmt_rp(running_qty*std_price)])
-            logs = logs.drop(saldo_awal_log.index)
-
-        for _, row in logs.iterrows():
-            qty = row['jumlah']
-            gerak = row['jenis_gerak']
-            p = row['harga_satuan'] if row['harga_satuan'] > 0 else std_price
-            
-            in_q = qty if gerak=='IN' else 0
-            out_q = qty if gerak=='OUT' else 0
-            
-            if gerak=='IN':
-                running_qty += qty
-            else:
-                running_qty -= qty
-            
-            data.append([
-                row['tanggal'], row['keterangan'],
-                fmt(in_q), fmt_rp(p) if in_q else "", fmt_rp(in_q*p),
-                fmt(out_q), fmt_rp(p) if out_q else "", fmt_rp(out_q*p),
-                fmt(running_qty), fmt_rp(p), fmt_rp(running_qty*p)
-            ])
-
-        cols = pd.MultiIndex.from_tuples([
-            ("Detail","Date"),("Detail","Desc"),
-            ("IN","Qty"),("IN","Price"),("IN","Total"),
-            ("OUT","Qty"),("OUT","Price"),("OUT","Total"),
-            ("Balance","Qty"),("Balance","Price"),("Balance","Total")
-        ])
-        return pd.DataFrame(data, columns=cols)
+    def _reap(self):
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._by_thread if i not in alive]:
+            self._idle.append(self._by_thread.pop(ident))
+
+    def acquire(self):
+        ident = threading.get_ident()
+        c = self._by_thread.get(ident)
+        if c is not None:
+            return c
+        with self._lock:
+            self._reap()
+            c = self._idle.pop() if self._idle else self._open()
+            if c.in_transaction:
+                c.rollback()
+            self._by_thread[ident] = c
+        return c
 
-    def init_db(self):
-        with self._conn() as c:
-            
-            c.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT)")
-            c.execute("CREATE TABLE IF NOT EXISTS akun (id INTEGER PRIMARY KEY AUTOINCREMENT, kode_akun TEXT UNIQUE, nama_akun TEXT UNIQUE, tipe_akun TEXT)")
-            c.execute("CREATE TABLE IF NOT EXISTS jurnal (id INTEGER PRIMARY KEY, tanggal TEXT, deskripsi TEXT, akun_debit TEXT, akun_kredit TEXT, nominal REAL, created_at TIMESTAMP, created_by TEXT)")
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS inventory (
-                    id INTEGER PRIMARY KEY, 
-                    kode_barang TEXT UNIQUE, 
-                    nama_barang TEXT, 
-                    kategori TEXT, 
-                    satuan TEXT, 
-                    stok_saat_ini REAL, 
-                    min_stok REAL
-                )
-            """)
+    def close_all(self):
+        with self._lock:
+            for c in list(self._by_thread.values()) + self._idle:
+                c.close()
+            self._by_thread.clear()
+            self._idle.clear()
+
+@st.cache_resource
+def get_pool(db_name):
+    return ConnectionPool(db_name)
+
+class AccountRegistry:
+    # Bagan akun dimuat sekali per proses & diindeks per nama/kode/tipe.
+    # Hanya di-reset saat Master Akun menambah/menghapus akun (invalidate()).
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+
+    def load(self, conn):
+        data = self._data
+        if data is not None:
+            return data
+        with self._lock:
+            if self._data is None:
+                rows = conn.execute("SELECT id, kode_akun, nama_akun, tipe_akun FROM akun ORDER BY id").fetchall()
+                akun = [{"id": i, "kode_akun": k, "nama_akun": n, "tipe_akun": t} for i, k, n, t in rows]
+                by_type = {}
+                for a in akun:
+                    by_type.setdefault(a["tipe_akun"], []).append(a["nama_akun"])
+                self._data = {
+                    "by_name": {a["nama_akun"]: a for a in akun},
+                    "by_code": {a["kode_akun"]: a for a in akun},
+                    "by_type": by_type,
+                    "names": [a["nama_akun"] for a in sorted(akun, key=lambda a: a["kode_akun"] or "")],
+                }
+            return self._data
+
+@st.cache_resource
+def get_account_registry(db_name):
+    return AccountRegistry()
+
+class QueryCache:
+    # LRU hasil query, dibagi semua sesi & rerun. Kunci memuat write_seq,
+    # jadi entri lama otomatis tidak terpakai begitu ada tulis ke database.
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._seq = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            seq = key[-1]
+            if self._seq is not None and seq < self._seq:
+                return
+            if seq != self._seq:
+                # versi baru: semua entri versi lama pasti basi
+                self._items.clear()
+                self._bytes = 0
+                self._seq = seq
+            if key in self._items:
+                return
+            self._items[key] = (df, size)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "bytes": self._bytes, "hits": self.hits, "misses": self.misses, "write_seq": self._seq}
+
+@st.cache_resource
+def get_query_cache(db_name):
+    return QueryCache()
+
+class QueryStats:
+    # Statistik eksekusi per statement (dinormalisasi spasinya), dibagi semua sesi di proses ini.
+    # Hilang saat server restart.
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, max_entries=500, max_slow=200):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+        self.slow = deque(maxlen=max_slow)
+
+    def record(self, q, p, ms, rows, error=None, cached=False):
+        sql = " ".join(q.split())
+        page = getattr(page_context, "page", None) or "-"
+        with self._lock:
+            st_q = self._queries.get(sql)
+            if st_q is None:
+                st_q = self._queries[sql] = {"count": 0, "cache_hits": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "pages": set(), "params": p}
+                while len(self._queries) > self.max_entries:
+                    self._queries.popitem(last=False)
+            self._queries.move_to_end(sql)
+            st_q["count"] += 1
+            st_q["cache_hits"] += cached
+            st_q["errors"] += error is not None
+            st_q["total_ms"] += ms
+            st_q["max_ms"] = max(st_q["max_ms"], ms)
+            st_q["rows"] += rows
+            st_q["pages"].add(page)
+            st_q["params"] = p
+            slow = ms >= self.threshold_ms
+            if slow:
+                self.slow.append({"waktu": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "ms": round(ms, 1), "halaman": page, "baris": rows, "sql": sql})
+        if slow:
+            slow_query_log.warning(f"{ms:.1f}ms|{page}|{rows} baris|{sql}|{p}")
+        if error is not None:
+            logging.warning(f"SYSTEM|QUERY_ERROR|{page}|{error}|{sql}")
+
+    def top_queries(self, n=20):
+        with self._lock:
+            rows = [{"sql": sql, **{k: v for k, v in d.items() if k not in ("pages", "params")}, "halaman": ", ".join(sorted(d["pages"]))} for sql, d in self._queries.items()]
+        df = pd.DataFrame(rows, columns=["sql", "count", "cache_hits", "errors", "total_ms", "max_ms", "rows", "halaman"])
+        df["avg_ms"] = (df["total_ms"] / df["count"]).round(2) if not df.empty else []
+        return df.sort_values("total_ms", ascending=False).head(n).round({"total_ms": 1, "max_ms": 1}).reset_index(drop=True)
+
+    def plan_targets(self, n=10):
+        # (sql, params) query terberat, untuk diumpankan ke audit_query_plans
+        with self._lock:
+            items = sorted(self._queries.items(), key=lambda kv: -kv[1]["total_ms"])
+        items = [(sql, d["params"]) for sql, d in items if sql.upper().startswith(("SELECT", "WITH"))]
+        return {f"#{i + 1} {sql[:70]}": (sql, p) for i, (sql, p) in enumerate(items[:n])}
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self.slow.clear()
+
+@st.cache_resource
+def get_query_stats(db_name):
+    return QueryStats()
+
+class TimedConnection:
+    # Bungkus koneksi pool: tiap execute/executemany lewat DatabaseManager.timed.
+    # Jumlah baris = rowcount (hanya berarti untuk tulis); SELECT dicatat 0 baris.
+    def __init__(self, db, conn):
+        self._db = db
+        self._conn = conn
+
+    def execute(self, q, p=()):
+        with self._db.timed(q, p) as rec:
+            cur = self._conn.execute(q, p)
+            rec["rows"] = max(cur.rowcount, 0)
+        return cur
+
+    def executemany(self, q, seq):
+        seq = list(seq)
+        with self._db.timed(q, seq[0] if seq else ()) as rec:
+            cur = self._conn.executemany(q, seq)
+            rec["rows"] = max(cur.rowcount, 0)
+        return cur
+
+    def commit(self):
+        with self._db.timed("COMMIT"):
+            self._conn.commit()
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+PROFILE_DIR = os.environ.get("HASNA_PROFILE_DIR", "profiles")
+
+class RenderProfiler:
+    # Histogram bergulir waktu render per (halaman, bagian): hanya N sampel terakhir yang disimpan.
+    BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self, window=200, max_dumps=5):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self.dumps = deque(maxlen=max_dumps)
+
+    def record(self, page, section, ms):
+        with self._lock:
+            self._samples.setdefault((page, section), deque(maxlen=self.window)).append(ms)
+
+    def summary(self):
+        with self._lock:
+            items = [(k, np.array(v)) for k, v in self._samples.items()]
+        rows = [{"halaman": page, "bagian": section, "n": len(v), "last_ms": v[-1], "p50_ms": np.percentile(v, 50),
+                 "p95_ms": np.percentile(v, 95), "max_ms": v.max()} for (page, section), v in items]
+        df = pd.DataFrame(rows, columns=["halaman", "bagian", "n", "last_ms", "p50_ms", "p95_ms", "max_ms"])
+        return df.sort_values(["halaman", "bagian"]).round(1).reset_index(drop=True)
+
+    def histogram(self, page, section):
+        with self._lock:
+            v = list(self._samples.get((page, section), ()))
+        labels = [f"≤{b:,}" for b in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]:,}"]
+        counts = np.bincount(np.searchsorted(self.BUCKETS_MS, v, side="left"), minlength=len(labels))
+        return pd.Series(counts, index=pd.Index(labels, name="ms"), name="render")
+
+    def dump(self, page, prof):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{page}_{datetime.now():%Y%m%d_%H%M%S}.prof")
+        prof.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(30)
+        self.dumps.append({"halaman": page, "waktu": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "path": path, "ringkasan": out.getvalue()})
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+@st.cache_resource
+def get_render_profiler():
+    return RenderProfiler()
+
+profiler = get_render_profiler()
+
+def migration_base_tables(c):
+    c.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS akun (id INTEGER PRIMARY KEY AUTOINCREMENT, kode_akun TEXT UNIQUE, nama_akun TEXT UNIQUE, tipe_akun TEXT)")
+    c.execute("CREATE TABLE IF NOT EXISTS jurnal (id INTEGER PRIMARY KEY, tanggal TEXT, deskripsi TEXT, akun_debit TEXT, akun_kredit TEXT, nominal REAL, created_at TIMESTAMP, created_by TEXT)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY, 
+            kode_barang TEXT UNIQUE, 
+            nama_barang TEXT, 
+            kategori TEXT, 
+            satuan TEXT, 
+            stok_saat_ini REAL, 
+            min_stok REAL
+        )
+    """)
+    c.execute("CREATE TABLE IF NOT EXISTS stock_log (id INTEGER PRIMARY KEY, tanggal TEXT, kode_barang TEXT, jenis_gerak TEXT, jumlah REAL, harga_satuan REAL DEFAULT 0, keterangan TEXT, user TEXT)")
+
+def migration_inventory_accounting(c):
+    # Database lama dibuat sebelum kolom ini ada, sebagian sudah punya sebagian.
+    existing_cols = [row['name'] for row in c.execute("PRAGMA table_info(inventory)").fetchall()]
+    if 'akun_aset' not in existing_cols:
+        c.execute("ALTER TABLE inventory ADD COLUMN akun_aset TEXT")
+    if 'akun_hpp' not in existing_cols:
+        c.execute("ALTER TABLE inventory ADD COLUMN akun_hpp TEXT")
+    if 'std_cost' not in existing_cols:
+        c.execute("ALTER TABLE inventory ADD COLUMN std_cost REAL DEFAULT 0")
+
+# Master barang bawaan: seed DB baru & pengisi std_cost/akun persediaan yang kosong di DB lama (satu sumber).
+# Harga pokok standar = yang dulu hard-coded di kartu stok (STD_COSTS).
+INVENTORY_DEFAULTS = [
+    ("PKN-MERAH", "Pakan Kukila Merah", "Pakan", "Sak", 0, 5, "Persediaan Pakan Ternak", "Beban Pakan", 360000),
+    ("PKN-BIRU", "Pakan Kukila Biru", "Pakan", "Sak", 0, 5, "Persediaan Pakan Ternak", "Beban Pakan", 435000),
+    ("TELUR", "Telur Puyuh", "Produk", "Dus", 0, 10, "Persediaan Telur Puyuh", "HPP Telur Puyuh", 100000),
+    ("PUPUK", "Pupuk Organik (Kotoran)", "Produk", "Sak", 0, 5, "Persediaan Kotoran (Pupuk)", "HPP Kotoran (Pupuk)", 6000),
+    ("VIT-OBAT", "Vitamin & Obat", "Obat", "Paket", 0, 2, "Persediaan Obat & Vitamin", "Beban Obat & Vitamin", 250000),
+]
+
+def migration_seed_master(c):
+    if not c.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+        c.execute("INSERT INTO users VALUES (?,?,?)", ('admin', make_hash('admin123'), 'Manager'))
+        c.execute("INSERT INTO users VALUES (?,?,?)", ('kasir', make_hash('staff123'), 'Staff'))
+    
+    if not c.execute("SELECT 1 FROM akun LIMIT 1").fetchone():
+        real_accounts = [
+            ("1-11", "Kas", "Aset"), ("1-12", "Bank Mandiri", "Aset"), ("1-13", "Piutang Dagang", "Aset"),
+            ("1-14", "Persediaan Telur Puyuh", "Aset"), ("1-15", "Persediaan Kotoran (Pupuk)", "Aset"),
+            ("1-16", "Persediaan Pakan Ternak", "Aset"), ("1-17", "Persediaan Obat & Vitamin", "Aset"),
+            ("1-21", "Bangunan Kandang", "Aset"), ("1-22", "Akumulasi Penyusutan Kandang", "Aset"),
+            ("1-23", "Kendaraan", "Aset"), ("1-24", "Akumulasi Penyusutan Kendaraan", "Aset"),
+            ("2-11", "Hutang Usaha", "Kewajiban"), ("3-11", "Modal Pemilik", "Modal"), ("3-12", "Prive", "Modal"),
+            ("4-11", "Penjualan Telur Puyuh", "Pendapatan"), ("4-12", "Penjualan Kotoran (Pupuk)", "Pendapatan"),
+            ("4-13", "Return Penjualan", "Pendapatan"),
+            ("5-11", "HPP Telur Puyuh", "Beban"), ("5-12", "HPP Kotoran (Pupuk)", "Beban"),
+            ("5-13", "Beban Pakan", "Beban"), ("5-14", "Beban Obat & Vitamin", "Beban"),
+            ("6-11", "Beban Transportasi", "Beban"), ("6-12", "Beban Listrik, Air, dan Telepon", "Beban"),
+            ("6-13", "Beban Penyusutan Kandang", "Beban"), ("6-14", "Beban Penyusutan Kendaraan", "Beban")
+        ]
+        c.executemany("INSERT INTO akun (kode_akun, nama_akun, tipe_akun) VALUES (?,?,?)", real_accounts)
+    
+    if not c.execute("SELECT 1 FROM inventory LIMIT 1").fetchone():
+        c.executemany("INSERT INTO inventory (kode_barang, nama_barang, kategori, satuan, stok_saat_ini, min_stok, akun_aset, akun_hpp, std_cost) VALUES (?,?,?,?,?,?,?,?,?)", INVENTORY_DEFAULTS)
+
+def migration_hot_query_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jurnal_debit ON jurnal (akun_debit, tanggal, nominal)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jurnal_kredit ON jurnal (akun_kredit, tanggal, nominal)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jurnal_tanggal ON jurnal (tanggal, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stock_log_barang ON stock_log (kode_barang, tanggal, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stock_log_tanggal ON stock_log (tanggal, id)")
+    c.execute("ANALYZE")
+
+def migration_account_balance(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS account_balance (
+            nama_akun TEXT PRIMARY KEY,
+            debit REAL NOT NULL DEFAULT 0,
+            kredit REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_balance_insert AFTER INSERT ON jurnal BEGIN
+            INSERT INTO account_balance (nama_akun, debit) VALUES (NEW.akun_debit, NEW.nominal)
+                ON CONFLICT (nama_akun) DO UPDATE SET debit = debit + excluded.debit;
+            INSERT INTO account_balance (nama_akun, kredit) VALUES (NEW.akun_kredit, NEW.nominal)
+                ON CONFLICT (nama_akun) DO UPDATE SET kredit = kredit + excluded.kredit;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_balance_delete AFTER DELETE ON jurnal BEGIN
+            UPDATE account_balance SET debit = debit - OLD.nominal WHERE nama_akun = OLD.akun_debit;
+            UPDATE account_balance SET kredit = kredit - OLD.nominal WHERE nama_akun = OLD.akun_kredit;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_balance_update AFTER UPDATE OF akun_debit, akun_kredit, nominal ON jurnal BEGIN
+            UPDATE account_balance SET debit = debit - OLD.nominal WHERE nama_akun = OLD.akun_debit;
+            UPDATE account_balance SET kredit = kredit - OLD.nominal WHERE nama_akun = OLD.akun_kredit;
+            INSERT INTO account_balance (nama_akun, debit) VALUES (NEW.akun_debit, NEW.nominal)
+                ON CONFLICT (nama_akun) DO UPDATE SET debit = debit + excluded.debit;
+            INSERT INTO account_balance (nama_akun, kredit) VALUES (NEW.akun_kredit, NEW.nominal)
+                ON CONFLICT (nama_akun) DO UPDATE SET kredit = kredit + excluded.kredit;
+        END
+    """)
+    c.execute("DELETE FROM account_balance")
+    c.execute(f"INSERT INTO account_balance (nama_akun, debit, kredit) {SQL_JURNAL_TOTALS_NAMA}")
+
+# key = kolom kunci akun di tabel turunan, ref = kolom akun di baris jurnal ({side} = debit/kredit).
+def daily_balance_sql(row, side, sign, key="nama_akun", ref="akun_{side}"):
+    # Geser saldo kumulatif akun sisi `side` mulai tanggal transaksi ke depan.
+    ref = ref.format(side=side)
+    return f"""
+            UPDATE account_daily_balance
+            SET cum_{side} = cum_{side} {sign} {row}.nominal,
+                {side} = {side} {sign} CASE WHEN tanggal = {row}.tanggal THEN {row}.nominal ELSE 0 END
+            WHERE {key} = {row}.{ref} AND tanggal >= {row}.tanggal;"""
+
+def daily_balance_open_sql(side, key="nama_akun", ref="akun_{side}"):
+    ref = ref.format(side=side)
+    return f"""
+            INSERT OR IGNORE INTO account_daily_balance ({key}, tanggal, debit, kredit, cum_debit, cum_kredit)
+            SELECT NEW.{ref}, NEW.tanggal, 0, 0, COALESCE(p.cum_debit, 0), COALESCE(p.cum_kredit, 0)
+            FROM (SELECT 1) LEFT JOIN (
+                SELECT cum_debit, cum_kredit FROM account_daily_balance
+                WHERE {key} = NEW.{ref} AND tanggal < NEW.tanggal ORDER BY tanggal DESC LIMIT 1
+            ) p ON 1
+            WHERE NEW.{ref} IS NOT NULL AND NEW.tanggal IS NOT NULL;"""
+
+def migration_daily_balance(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS account_daily_balance (
+            nama_akun TEXT NOT NULL,
+            tanggal TEXT NOT NULL,
+            debit REAL NOT NULL DEFAULT 0,
+            kredit REAL NOT NULL DEFAULT 0,
+            cum_debit REAL NOT NULL DEFAULT 0,
+            cum_kredit REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (nama_akun, tanggal)
+        ) WITHOUT ROWID
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_daily_insert AFTER INSERT ON jurnal BEGIN
+            {daily_balance_open_sql('debit')}
+            {daily_balance_open_sql('kredit')}
+            {daily_balance_sql('NEW', 'debit', '+')}
+            {daily_balance_sql('NEW', 'kredit', '+')}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_daily_delete AFTER DELETE ON jurnal BEGIN
+            {daily_balance_sql('OLD', 'debit', '-')}
+            {daily_balance_sql('OLD', 'kredit', '-')}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_daily_update AFTER UPDATE OF tanggal, akun_debit, akun_kredit, nominal ON jurnal BEGIN
+            {daily_balance_sql('OLD', 'debit', '-')}
+            {daily_balance_sql('OLD', 'kredit', '-')}
+            {daily_balance_open_sql('debit')}
+            {daily_balance_open_sql('kredit')}
+            {daily_balance_sql('NEW', 'debit', '+')}
+            {daily_balance_sql('NEW', 'kredit', '+')}
+        END
+    """)
+    c.execute("DELETE FROM account_daily_balance")
+    c.execute(f"INSERT INTO account_daily_balance (nama_akun, tanggal, debit, kredit, cum_debit, cum_kredit) {SQL_DAILY_TOTALS_NAMA}")
+
+def migration_inventory_defaults(c):
+    # Database lama: std_cost 0 dan akun_aset/akun_hpp NULL -> kartu stok & HPP penjualan bernilai nol.
+    # Hanya mengisi yang kosong; nilai yang sudah diatur user tidak disentuh.
+    for kode, _, _, _, _, _, aset, hpp, cost in INVENTORY_DEFAULTS:
+        c.execute("UPDATE inventory SET std_cost = ? WHERE kode_barang = ? AND COALESCE(std_cost, 0) = 0", (cost, kode))
+        for col, nama in (("akun_aset", aset), ("akun_hpp", hpp)):
+            c.execute(f"UPDATE inventory SET {col} = ? WHERE kode_barang = ? AND COALESCE({col}, '') = '' "
+                      "AND EXISTS (SELECT 1 FROM akun WHERE nama_akun = ?)", (nama, kode, nama))
+
+def rollup_sql(row, sign, key="nama_akun", ref="akun_{side}", filt=None):
+    # Upsert 3 grain x 2 sisi untuk satu baris jurnal (sign '+' saat masuk, '-' saat keluar).
+    cond = f" AND {filt.format(row=row + '.')}" if filt else ""
+    return "".join(f"""
+            INSERT INTO jurnal_rollup (grain, periode, {key}, sisi, nominal, jumlah)
+            SELECT '{g}', substr({row}.tanggal, 1, {n}), {row}.{ref.format(side=side)}, '{side[0].upper()}', {sign}{row}.nominal, {sign}1
+            WHERE {row}.{ref.format(side=side)} IS NOT NULL AND {row}.tanggal IS NOT NULL{cond}
+            ON CONFLICT (grain, periode, {key}, sisi) DO UPDATE SET nominal = nominal + excluded.nominal, jumlah = jumlah + excluded.jumlah;"""
+        for g, n in ROLLUP_GRAINS.items() for side in ("debit", "kredit"))
+
+def rollup_cleanup_sql(key="nama_akun", ref="akun_{side}"):
+    # Buang baris periode yang sudah tidak punya transaksi agar grafik tidak menampilkan periode kosong.
+    grains = ", ".join(f"'{g}'" for g in ROLLUP_GRAINS)
+    periods = ", ".join(f"substr(OLD.tanggal, 1, {n})" for n in ROLLUP_GRAINS.values())
+    return f"""
+            DELETE FROM jurnal_rollup WHERE jumlah = 0 AND grain IN ({grains}) AND periode IN ({periods})
+                AND {key} IN (OLD.{ref.format(side='debit')}, OLD.{ref.format(side='kredit')});"""
+
+def migration_rollup(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS jurnal_rollup (
+            grain TEXT NOT NULL,
+            periode TEXT NOT NULL,
+            nama_akun TEXT NOT NULL,
+            sisi TEXT NOT NULL,
+            nominal REAL NOT NULL DEFAULT 0,
+            jumlah INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (grain, periode, nama_akun, sisi)
+        ) WITHOUT ROWID
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_rollup_insert AFTER INSERT ON jurnal BEGIN
+            {rollup_sql('NEW', '+')}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_rollup_delete AFTER DELETE ON jurnal BEGIN
+            {rollup_sql('OLD', '-')}
+            {rollup_cleanup_sql()}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jurnal_rollup_update AFTER UPDATE OF tanggal, akun_debit, akun_kredit, nominal ON jurnal BEGIN
+            {rollup_sql('OLD', '-')}
+            {rollup_cleanup_sql()}
+            {rollup_sql('NEW', '+')}
+        END
+    """)
+    c.execute("DELETE FROM jurnal_rollup")
+    c.execute(f"INSERT INTO jurnal_rollup (grain, periode, nama_akun, sisi, nominal, jumlah) {SQL_ROLLUP_TOTALS_NAMA}")
+
+# Indeks FTS5 (external content) per tabel sumber: (tabel fts, tabel, kolom teks).
+FTS_INDEXES = (("jurnal_fts", "jurnal", "deskripsi"), ("stock_log_fts", "stock_log", "keterangan"))
+
+def create_fts(c, fts, tbl, col):
+    c.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {col}, content='{tbl}', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {tbl} BEGIN
+            INSERT INTO {fts} (rowid, {col}) VALUES (NEW.id, NEW.{col});
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {tbl} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {col}) VALUES ('delete', OLD.id, OLD.{col});
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {col} ON {tbl} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {col}) VALUES ('delete', OLD.id, OLD.{col});
+            INSERT INTO {fts} (rowid, {col}) VALUES (NEW.id, NEW.{col});
+        END
+    """)
+    c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def migration_fulltext(c):
+    for fts, tbl, col in FTS_INDEXES:
+        create_fts(c, fts, tbl, col)
+
+# Jenis transaksi jurnal, diisi oleh jalur posting (bukan ditebak dari teks deskripsi).
+JENIS_JURNAL = ("JUAL", "BELI", "HPP", "BIAYA", "UMUM", "SALDO_AWAL", "KOREKSI", "PENUTUP")
+
+def migration_jenis_jurnal(c):
+    existing_cols = [row['name'] for row in c.execute("PRAGMA table_info(jurnal)").fetchall()]
+    if 'jenis' not in existing_cols:
+        c.execute("ALTER TABLE jurnal ADD COLUMN jenis TEXT NOT NULL DEFAULT 'UMUM'")
+    # Backfill data lama: aturan berurutan dari pola deskripsi & akun yang dipakai form selama ini.
+    c.execute("""
+        UPDATE jurnal SET jenis = CASE
+            WHEN deskripsi LIKE 'Saldo Awal%' OR 'Historical Balancing' IN (akun_debit, akun_kredit) THEN 'SALDO_AWAL'
+            WHEN deskripsi LIKE 'Koreksi%' OR deskripsi LIKE 'Retur%' OR 'Return Penjualan' IN (akun_debit, akun_kredit)
+                 OR akun_kredit LIKE 'HPP%' THEN 'KOREKSI'
+            WHEN deskripsi LIKE 'Cost of Goods Sold%' OR akun_debit LIKE 'HPP%' THEN 'HPP'
+            WHEN deskripsi LIKE 'JUAL%' OR akun_kredit IN (SELECT nama_akun FROM akun WHERE tipe_akun = 'Pendapatan') THEN 'JUAL'
+            WHEN akun_debit LIKE 'Persediaan%' OR akun_debit IN (SELECT akun_aset FROM inventory WHERE akun_aset IS NOT NULL) THEN 'BELI'
+            WHEN akun_debit IN (SELECT nama_akun FROM akun WHERE tipe_akun = 'Beban') THEN 'BIAYA'
+            ELSE 'UMUM'
+        END
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jurnal_jenis ON jurnal (jenis, tanggal, id)")
+    c.execute("ANALYZE")
+
+def rebuild_derived_nama(c):
+    c.execute("DELETE FROM account_balance")
+    c.execute(f"INSERT INTO account_balance (nama_akun, debit, kredit) {SQL_JURNAL_TOTALS_NAMA}")
+    c.execute("DELETE FROM account_daily_balance")
+    c.execute(f"INSERT INTO account_daily_balance (nama_akun, tanggal, debit, kredit, cum_debit, cum_kredit) {SQL_DAILY_TOTALS_NAMA}")
+    c.execute("DELETE FROM jurnal_rollup")
+    c.execute(f"INSERT INTO jurnal_rollup (grain, periode, nama_akun, sisi, nominal, jumlah) {SQL_ROLLUP_TOTALS_NAMA}")
+
+def rebuild_derived(c):
+    # Hitung ulang semua tabel turunan jurnal dari nol.
+    c.execute("DELETE FROM account_balance")
+    c.execute(f"INSERT INTO account_balance (akun_id, debit, kredit) {SQL_JURNAL_TOTALS}")
+    c.execute("DELETE FROM account_daily_balance")
+    c.execute(f"INSERT INTO account_daily_balance (akun_id, tanggal, debit, kredit, cum_debit, cum_kredit) {SQL_DAILY_TOTALS}")
+    c.execute("DELETE FROM jurnal_rollup")
+    c.execute(f"INSERT INTO jurnal_rollup (grain, periode, akun_id, sisi, nominal, jumlah) {SQL_ROLLUP_TOTALS}")
+
+def retype_integer_columns(c, table, cols):
+    # SQLite tidak punya ALTER COLUMN: buat tabel baru dengan kolom INTEGER, salin (dibulatkan ke rupiah),
+    # ganti nama, lalu pasang lagi index & trigger milik tabel itu.
+    ddl = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    extras = [r[0] for r in c.execute("SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL", (table,))]
+    for col in cols:
+        ddl = re.sub(rf"\b{col}\s+REAL\b", f"{col} INTEGER", ddl)
+    ddl = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?{table}\b", f"CREATE TABLE {table}__baru", ddl)
+    names = [row['name'] for row in c.execute(f"PRAGMA table_info({table})").fetchall()]
+    select = ", ".join(f"CAST(ROUND({n}) AS INTEGER)" if n in cols else n for n in names)
+    c.execute(ddl)
+    c.execute(f"INSERT INTO {table}__baru ({', '.join(names)}) SELECT {select} FROM {table}")
+    c.execute(f"DROP TABLE {table}")
+    # legacy: jangan validasi ulang trigger tabel lain yang merujuk tabel ini selama sempat hilang
+    c.execute("PRAGMA legacy_alter_table = ON")
+    c.execute(f"ALTER TABLE {table}__baru RENAME TO {table}")
+    c.execute("PRAGMA legacy_alter_table = OFF")
+    for sql in extras:
+        c.execute(sql)
+
+MONEY_COLUMNS = {
+    "jurnal": ("nominal",),
+    "stock_log": ("harga_satuan",),
+    "inventory": ("std_cost",),
+    "account_balance": ("debit", "kredit"),
+    "account_daily_balance": ("debit", "kredit", "cum_debit", "cum_kredit"),
+    "jurnal_rollup": ("nominal",),
+}
+
+def migration_integer_money(c):
+    for table, cols in MONEY_COLUMNS.items():
+        retype_integer_columns(c, table, cols)
+    rebuild_derived_nama(c)
+    c.execute("ANALYZE")
+
+VERSIONED_TABLES = ("jurnal", "stock_log", "inventory", "akun", "users")
+
+def migration_write_seq(c):
+    # Penghitung tulis global: naik di setiap INSERT/UPDATE/DELETE tabel dasar -> kunci QueryCache.
+    c.execute("CREATE TABLE IF NOT EXISTS write_seq (id INTEGER PRIMARY KEY CHECK (id = 1), seq INTEGER NOT NULL)")
+    c.execute("INSERT OR IGNORE INTO write_seq (id, seq) VALUES (1, 0)")
+    for t in VERSIONED_TABLES:
+        create_seq_triggers(c, t)
+
+def create_seq_triggers(c, t):
+    for op in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS trg_seq_{t}_{op.lower()} AFTER {op} ON {t} BEGIN UPDATE write_seq SET seq = seq + 1 WHERE id = 1; END")
+
+# Akun yang dipakai jalur posting walau tidak ada di bagan akun bawaan: (kode, nama, tipe).
+SYSTEM_ACCOUNTS = (("3-99", "Historical Balancing", "Modal"), ("1-19", "Persediaan (Umum)", "Aset"))
+AKUN_ID_REF = "akun_{side}_id"
+
+# Kompatibilitas: layar & query lama tetap membaca/menulis `jurnal` dengan nama akun;
+# baris aslinya di jurnal_data memakai akun.id. CROSS JOIN = jurnal_data selalu loop luar, jadi
+# ORDER BY tanggal/id & kursor keyset tetap lewat index walau statistik ANALYZE basi (mis. DB baru).
+SQL_JURNAL_VIEW = """
+    CREATE VIEW jurnal AS
+    SELECT j.id, j.tanggal, j.deskripsi, d.nama_akun AS akun_debit, k.nama_akun AS akun_kredit,
+           j.nominal, j.created_at, j.created_by, j.jenis
+    FROM jurnal_data j
+    CROSS JOIN akun d ON d.id = j.akun_debit_id
+    CROSS JOIN akun k ON k.id = j.akun_kredit_id
+"""
+
+def akun_id_sql(ref):
+    return f"(SELECT id FROM akun WHERE nama_akun = {ref})"
+
+def akun_check_sql(row):
+    return "".join(f"""
+            SELECT RAISE(ABORT, 'Akun {side} tidak terdaftar di bagan akun') WHERE {akun_id_sql(f"{row}.akun_{side}")} IS NULL;"""
+        for side in ("debit", "kredit"))
+
+def migration_akun_id(c):
+    # Nama akun yang dipakai jurnal tapi belum ada di tabel akun -> dibuatkan akunnya dulu.
+    used = {r[0] for r in c.execute("SELECT kode_akun FROM akun")}
+    orphans = [(None, r[0], "Aset" if r[0].startswith("Persediaan") else None) for r in c.execute("""
+        SELECT akun_debit FROM jurnal UNION SELECT akun_kredit FROM jurnal
+        EXCEPT SELECT nama_akun FROM akun
+    """) if r[0] is not None]
+    n = 0
+    for kode, nama, tipe in list(SYSTEM_ACCOUNTS) + orphans:
+        if c.execute("SELECT 1 FROM akun WHERE nama_akun = ?", (nama,)).fetchone():
+            continue
+        while kode is None or kode in used:
+            n += 1
+            kode = f"9-{n:02d}"
+        used.add(kode)
+        c.execute("INSERT INTO akun (kode_akun, nama_akun, tipe_akun) VALUES (?,?,?)", (kode, nama, tipe))
+
+    c.execute("""
+        CREATE TABLE jurnal_data (
+            id INTEGER PRIMARY KEY,
+            tanggal TEXT,
+            deskripsi TEXT,
+            akun_debit_id INTEGER NOT NULL REFERENCES akun (id),
+            akun_kredit_id INTEGER NOT NULL REFERENCES akun (id),
+            nominal INTEGER,
+            created_at TIMESTAMP,
+            created_by TEXT,
+            jenis TEXT NOT NULL DEFAULT 'UMUM'
+        )
+    """)
+    # LEFT JOIN + cek: baris tanpa akun (mis. nama akun NULL) menggagalkan migrasi, bukan hilang diam-diam.
+    copy_sql = """
+        SELECT j.id, j.tanggal, j.deskripsi, d.id AS debit_id, k.id AS kredit_id, j.nominal, j.created_at, j.created_by, j.jenis
+        FROM jurnal j LEFT JOIN akun d ON d.nama_akun = j.akun_debit LEFT JOIN akun k ON k.nama_akun = j.akun_kredit
+    """
+    bad = [r[0] for r in c.execute(f"SELECT id FROM ({copy_sql}) WHERE debit_id IS NULL OR kredit_id IS NULL ORDER BY id")]
+    if bad:
+        raise RuntimeError(f"Migrasi akun_id dibatalkan: {len(bad)} jurnal tanpa akun terdaftar (id: {', '.join(map(str, bad[:50]))}"
+                           f"{', ...' if len(bad) > 50 else ''})")
+    c.execute(f"INSERT INTO jurnal_data (id, tanggal, deskripsi, akun_debit_id, akun_kredit_id, nominal, created_at, created_by, jenis) {copy_sql}")
+    # Tabel turunan & trigger lama dikunci nama; dibuang dan dibangun ulang dengan akun_id.
+    for t in ("jurnal_fts", "jurnal", "account_balance", "account_daily_balance", "jurnal_rollup"):
+        c.execute(f"DROP TABLE {t}")
+    c.execute("CREATE INDEX idx_jurnal_debit ON jurnal_data (akun_debit_id, tanggal, nominal)")
+    c.execute("CREATE INDEX idx_jurnal_kredit ON jurnal_data (akun_kredit_id, tanggal, nominal)")
+    c.execute("CREATE INDEX idx_jurnal_tanggal ON jurnal_data (tanggal, id)")
+    c.execute("CREATE INDEX idx_jurnal_jenis ON jurnal_data (jenis, tanggal, id)")
+
+    c.execute(SQL_JURNAL_VIEW)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_view_insert INSTEAD OF INSERT ON jurnal BEGIN
+            {akun_check_sql('NEW')}
+            INSERT INTO jurnal_data (id, tanggal, deskripsi, akun_debit_id, akun_kredit_id, nominal, created_at, created_by, jenis)
+            VALUES (NEW.id, NEW.tanggal, NEW.deskripsi, {akun_id_sql('NEW.akun_debit')}, {akun_id_sql('NEW.akun_kredit')},
+                    NEW.nominal, NEW.created_at, NEW.created_by, COALESCE(NEW.jenis, 'UMUM'));
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_view_update INSTEAD OF UPDATE ON jurnal BEGIN
+            {akun_check_sql('NEW')}
+            UPDATE jurnal_data SET tanggal = NEW.tanggal, deskripsi = NEW.deskripsi,
+                akun_debit_id = {akun_id_sql('NEW.akun_debit')}, akun_kredit_id = {akun_id_sql('NEW.akun_kredit')},
+                nominal = NEW.nominal, created_by = NEW.created_by, jenis = NEW.jenis
+            WHERE id = OLD.id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER trg_jurnal_view_delete INSTEAD OF DELETE ON jurnal BEGIN
+            DELETE FROM jurnal_data WHERE id = OLD.id;
+        END
+    """)
+
+    c.execute("""
+        CREATE TABLE account_balance (
+            akun_id INTEGER PRIMARY KEY,
+            debit INTEGER NOT NULL DEFAULT 0,
+            kredit INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER trg_jurnal_balance_insert AFTER INSERT ON jurnal_data BEGIN
+            INSERT INTO account_balance (akun_id, debit) VALUES (NEW.akun_debit_id, NEW.nominal)
+                ON CONFLICT (akun_id) DO UPDATE SET debit = debit + excluded.debit;
+            INSERT INTO account_balance (akun_id, kredit) VALUES (NEW.akun_kredit_id, NEW.nominal)
+                ON CONFLICT (akun_id) DO UPDATE SET kredit = kredit + excluded.kredit;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER trg_jurnal_balance_delete AFTER DELETE ON jurnal_data BEGIN
+            UPDATE account_balance SET debit = debit - OLD.nominal WHERE akun_id = OLD.akun_debit_id;
+            UPDATE account_balance SET kredit = kredit - OLD.nominal WHERE akun_id = OLD.akun_kredit_id;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER trg_jurnal_balance_update AFTER UPDATE OF akun_debit_id, akun_kredit_id, nominal ON jurnal_data BEGIN
+            UPDATE account_balance SET debit = debit - OLD.nominal WHERE akun_id = OLD.akun_debit_id;
+            UPDATE account_balance SET kredit = kredit - OLD.nominal WHERE akun_id = OLD.akun_kredit_id;
+            INSERT INTO account_balance (akun_id, debit) VALUES (NEW.akun_debit_id, NEW.nominal)
+                ON CONFLICT (akun_id) DO UPDATE SET debit = debit + excluded.debit;
+            INSERT INTO account_balance (akun_id, kredit) VALUES (NEW.akun_kredit_id, NEW.nominal)
+                ON CONFLICT (akun_id) DO UPDATE SET kredit = kredit + excluded.kredit;
+        END
+    """)
+
+    c.execute("""
+        CREATE TABLE account_daily_balance (
+            akun_id INTEGER NOT NULL,
+            tanggal TEXT NOT NULL,
+            debit INTEGER NOT NULL DEFAULT 0,
+            kredit INTEGER NOT NULL DEFAULT 0,
+            cum_debit INTEGER NOT NULL DEFAULT 0,
+            cum_kredit INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (akun_id, tanggal)
+        ) WITHOUT ROWID
+    """)
+    k = dict(key="akun_id", ref=AKUN_ID_REF)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_daily_insert AFTER INSERT ON jurnal_data BEGIN
+            {daily_balance_open_sql('debit', **k)}
+            {daily_balance_open_sql('kredit', **k)}
+            {daily_balance_sql('NEW', 'debit', '+', **k)}
+            {daily_balance_sql('NEW', 'kredit', '+', **k)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_daily_delete AFTER DELETE ON jurnal_data BEGIN
+            {daily_balance_sql('OLD', 'debit', '-', **k)}
+            {daily_balance_sql('OLD', 'kredit', '-', **k)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_daily_update AFTER UPDATE OF tanggal, akun_debit_id, akun_kredit_id, nominal ON jurnal_data BEGIN
+            {daily_balance_sql('OLD', 'debit', '-', **k)}
+            {daily_balance_sql('OLD', 'kredit', '-', **k)}
+            {daily_balance_open_sql('debit', **k)}
+            {daily_balance_open_sql('kredit', **k)}
+            {daily_balance_sql('NEW', 'debit', '+', **k)}
+            {daily_balance_sql('NEW', 'kredit', '+', **k)}
+        END
+    """)
+
+    c.execute("""
+        CREATE TABLE jurnal_rollup (
+            grain TEXT NOT NULL,
+            periode TEXT NOT NULL,
+            akun_id INTEGER NOT NULL,
+            sisi TEXT NOT NULL,
+            nominal INTEGER NOT NULL DEFAULT 0,
+            jumlah INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (grain, periode, akun_id, sisi)
+        ) WITHOUT ROWID
+    """)
+    create_rollup_triggers(c)
+
+    create_fts(c, "jurnal_fts", "jurnal_data", "deskripsi")
+    create_seq_triggers(c, "jurnal_data")
+    # Ganti nama akun: histori ikut lewat id; referensi nama di master barang ikut diperbarui.
+    c.execute("""
+        CREATE TRIGGER trg_akun_rename AFTER UPDATE OF nama_akun ON akun BEGIN
+            UPDATE inventory SET akun_aset = NEW.nama_akun WHERE akun_aset = OLD.nama_akun;
+            UPDATE inventory SET akun_hpp = NEW.nama_akun WHERE akun_hpp = OLD.nama_akun;
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER trg_akun_delete_guard BEFORE DELETE ON akun
+        WHEN EXISTS (SELECT 1 FROM jurnal_data WHERE akun_debit_id = OLD.id)
+          OR EXISTS (SELECT 1 FROM jurnal_data WHERE akun_kredit_id = OLD.id) BEGIN
+            SELECT RAISE(ABORT, 'Akun masih dipakai di jurnal');
+        END
+    """)
+    rebuild_derived(c)
+    c.execute("ANALYZE")
+
+def create_rollup_triggers(c):
+    k = dict(key="akun_id", ref=AKUN_ID_REF)
+    f = dict(k, filt=ROLLUP_FILTER)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_rollup_insert AFTER INSERT ON jurnal_data BEGIN
+            {rollup_sql('NEW', '+', **f)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_rollup_delete AFTER DELETE ON jurnal_data BEGIN
+            {rollup_sql('OLD', '-', **f)}
+            {rollup_cleanup_sql(**k)}
+        END
+    """)
+    c.execute(f"""
+        CREATE TRIGGER trg_jurnal_rollup_update AFTER UPDATE OF tanggal, akun_debit_id, akun_kredit_id, nominal, jenis ON jurnal_data BEGIN
+            {rollup_sql('OLD', '-', **f)}
+            {rollup_cleanup_sql(**k)}
+            {rollup_sql('NEW', '+', **f)}
+        END
+    """)
+
+def migration_tutup_buku(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS periode_tutup (
+            sampai TEXT PRIMARY KEY,
+            akun_modal_id INTEGER NOT NULL REFERENCES akun (id),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_by TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS saldo_tutup (
+            sampai TEXT NOT NULL,
+            akun_id INTEGER NOT NULL,
+            debit INTEGER NOT NULL DEFAULT 0,
+            kredit INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (sampai, akun_id)
+        ) WITHOUT ROWID
+    """)
+    # Jurnal bertanggal <= tanggal tutup terakhir dikunci: tidak bisa ditambah, diubah, atau dihapus.
+    frozen = "substr({row}.tanggal, 1, 10) <= (SELECT MAX(sampai) FROM periode_tutup)"
+    for op, cond in (("INSERT", frozen.format(row="NEW")), ("DELETE", frozen.format(row="OLD")),
+                     ("UPDATE", f"{frozen.format(row='OLD')} OR {frozen.format(row='NEW')}")):
+        c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_jurnal_frozen_{op.lower()} BEFORE {op} ON jurnal_data WHEN {cond} BEGIN
+                SELECT RAISE(ABORT, 'Periode sudah ditutup (tutup buku)');
+            END
+        """)
+    create_seq_triggers(c, "periode_tutup")
+
+def migration_rollup_tanpa_penutup(c):
+    # DB yang sudah tutup buku: jurnal PENUTUP terlanjur masuk rollup (lonjakan tren laba, beban nol di grafik).
+    for op in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_jurnal_rollup_{op}")
+    create_rollup_triggers(c)
+    c.execute("DELETE FROM jurnal_rollup")
+    c.execute(f"INSERT INTO jurnal_rollup (grain, periode, akun_id, sisi, nominal, jumlah) {SQL_ROLLUP_TOTALS}")
+
+# Urutan tetap: versi skema = posisi di list (PRAGMA user_version). Tambah di akhir saja.
+MIGRATIONS = [
+    migration_base_tables,
+    migration_inventory_accounting,
+    migration_seed_master,
+    migration_hot_query_indexes,
+    migration_account_balance,
+    migration_daily_balance,
+    migration_inventory_defaults,
+    migration_write_seq,
+    migration_rollup,
+    migration_fulltext,
+    migration_jenis_jurnal,
+    migration_integer_money,
+    migration_akun_id,
+    migration_tutup_buku,
+    migration_rollup_tanpa_penutup,
+]
+
+STOCK_CARD_COLS = pd.MultiIndex.from_tuples([
+    ("Detail","Date"),("Detail","Desc"),
+    ("IN","Qty"),("IN","Price"),("IN","Total"),
+    ("OUT","Qty"),("OUT","Price"),("OUT","Total"),
+    ("Balance","Qty"),("Balance","Price"),("Balance","Total")
+])
+
+def compute_stock_card(logs, std_price, method="standard"):
+    # Kartu stok numerik. method="standard": harga log (fallback std_cost);
+    # method="average": rata-rata bergerak dari harga pembelian.
+    if logs.empty:
+        return pd.DataFrame(columns=STOCK_CARD_COLS)
+
+    is_sa = logs['keterangan'].str.contains('Saldo Awal', case=False, na=False) & (logs['jenis_gerak'] == 'IN')
+    open_qty = 0.0
+    open_price = std_price
+    opening = []
+    if is_sa.any():
+        sa = logs[is_sa].iloc[0]
+        open_qty = float(sa['jumlah'])
+        if method == "average" and sa['harga_satuan'] > 0:
+            open_price = float(sa['harga_satuan'])
+        opening = [["", "Saldo Awal", 0, 0, 0, 0, 0, 0, open_qty, open_price, open_qty * open_price]]
+        logs = logs.drop(sa.name)
+
+    qty = logs['jumlah'].fillna(0).to_numpy(dtype=float)
+    is_in = (logs['jenis_gerak'] == 'IN').to_numpy()
+    is_out = (logs['jenis_gerak'] == 'OUT').to_numpy()
+    price = logs['harga_satuan'].fillna(0).to_numpy(dtype=float)
+    price = np.where(price > 0, price, std_price)
+    bal_qty = open_qty + np.cumsum(np.where(is_in, qty, -qty))
+
+    if method == "average":
+        # Rata-rata hanya berubah saat barang masuk; loop cukup atas baris IN saja.
+        avg = np.full(len(qty), np.nan)
+        cur = open_price
+        for i in np.flatnonzero(is_in):
+            q_before = bal_qty[i] - qty[i]
+            cur = price[i] if q_before <= 0 else (cur * q_before + qty[i] * price[i]) / bal_qty[i]
+            avg[i] = cur
+        avg = pd.Series(avg).ffill().fillna(open_price).to_numpy()
+        in_price, out_price, bal_price = price, avg, avg
+    else:
+        in_price = out_price = bal_price = price
+
+    in_q = np.where(is_in, qty, 0)
+    out_q = np.where(is_out, qty, 0)
+    card = pd.DataFrame({
+        ("Detail","Date"): logs['tanggal'].to_numpy(), ("Detail","Desc"): logs['keterangan'].to_numpy(),
+        ("IN","Qty"): in_q, ("IN","Price"): np.where(in_q > 0, in_price, 0), ("IN","Total"): in_q * in_price,
+        ("OUT","Qty"): out_q, ("OUT","Price"): np.where(out_q > 0, out_price, 0), ("OUT","Total"): out_q * out_price,
+        ("Balance","Qty"): bal_qty, ("Balance","Price"): bal_price, ("Balance","Total"): bal_qty * bal_price,
+    })
+    if opening:
+        card = pd.concat([pd.DataFrame(opening, columns=STOCK_CARD_COLS), card], ignore_index=True)
+    card.columns = STOCK_CARD_COLS
+    return card
+
+def stock_card_rows_html(card):
+    def fmt(v): return f"{v:,.0f}" if v > 0 else ""
+    def fmt_rp(v): return f"Rp{v:,.0f}" if v > 0 else ""
+
+    rows = []
+    for tgl, desc, iq, ip, it, oq, op, ot, bq, bp, bt in card.itertuples(index=False, name=None):
+        desc = desc or ""
+        if desc.strip() in ["Buy:", ""]: desc = '<span style="color:#9ca3af; font-style:italic;">(Pembelian Stok)</span>'
+        elif desc.strip() in ["Sold:", "Sell:"]: desc = '<span style="color:#9ca3af; font-style:italic;">(Penjualan Produk)</span>'
+        rows.append(f"""<tr>
+                    <td>{tgl}</td><td>{desc}</td>
+                    <td><span class="{'val-in' if iq > 0 else ''}">{fmt(iq)}</span></td><td style="color:#666">{fmt_rp(ip)}</td><td style="color:#666">{fmt_rp(it)}</td>
+                    <td><span class="{'val-out' if oq > 0 else ''}">{fmt(oq)}</span></td><td style="color:#666">{fmt_rp(op)}</td><td style="color:#666">{fmt_rp(ot)}</td>
+                    <td class="val-bal">{fmt(bq)}</td><td>{fmt_rp(bp)}</td><td>{fmt_rp(bt)}</td>
+                </tr>""")
+    return "".join(rows)
+
+STOCK_CARD_PAGE_SIZE = 100
+
+SQL_WRITE_SEQ = "SELECT seq FROM write_seq WHERE id = 1"
 
-            
-            cursor = c.execute("PRAGMA table_info(inventory)")
-            
-            existing_cols = [row['name'] for row in cursor.fetchall()]
+class DatabaseManager:
+    def __init__(self, db_name):
+        self.db_name = db_name
+        self.pool = get_pool(db_name)
+        self.coa = get_account_registry(db_name)
+        self.cache = get_query_cache(db_name)
+        self.stats = get_query_stats(db_name)
 
-            
-            if 'akun_aset' not in existing_cols:
-                c.execute("ALTER TABLE inventory ADD COLUMN akun_aset TEXT")
-            
-            if 'akun_hpp' not in existing_cols:
-                c.execute("ALTER TABLE inventory ADD COLUMN akun_hpp TEXT")
-            
-            if 'std_cost' not in existing_cols:
-                c.execute("ALTER TABLE inventory ADD COLUMN std_cost REAL DEFAULT 0")
+    def _conn(self):
+        return self.pool.acquire()
 
-            c.execute("CREATE TABLE IF NOT EXISTS stock_log (id INTEGER PRIMARY KEY, tanggal TEXT, kode_barang TEXT, jenis_gerak TEXT, jumlah REAL, harga_satuan REAL DEFAULT 0, keterangan TEXT, user TEXT)")
+    def _timed_conn(self):
+        return TimedConnection(self, self._conn())
 
-           
-            if not c.execute("SELECT * FROM users").fetchone():
-                c.execute("INSERT INTO users VALUES (?,?,?)", ('admin', make_hash('admin123'), 'Manager'))
-                c.execute("INSERT INTO users VALUES (?,?,?)", ('kasir', make_hash('staff123'), 'Staff'))
-            
-            if not c.execute("SELECT * FROM akun").fetchone():
-                real_accounts = [
-                    ("1-11", "Kas", "Aset"), ("1-12", "Bank Mandiri", "Aset"), ("1-13", "Piutang Dagang", "Aset"),
-                    ("1-14", "Persediaan Telur Puyuh", "Aset"), ("1-15", "Persediaan Kotoran (Pupuk)", "Aset"),
-                    ("1-16", "Persediaan Pakan Ternak", "Aset"), ("1-17", "Persediaan Obat & Vitamin", "Aset"),
-                    ("1-21", "Bangunan Kandang", "Aset"), ("1-22", "Akumulasi Penyusutan Kandang", "Aset"),
-                    ("1-23", "Kendaraan", "Aset"), ("1-24", "Akumulasi Penyusutan Kendaraan", "Aset"),
-                    ("2-11", "Hutang Usaha", "Kewajiban"), ("3-11", "Modal Pemilik", "Modal"), ("3-12", "Prive", "Modal"),
-                    ("4-11", "Penjualan Telur Puyuh", "Pendapatan"), ("4-12", "Penjualan Kotoran (Pupuk)", "Pendapatan"),
-                    ("4-13", "Return Penjualan", "Pendapatan"),
-                    ("5-11", "HPP Telur Puyuh", "Beban"), ("5-12", "HPP Kotoran (Pupuk)", "Beban"),
-                    ("5-13", "Beban Pakan", "Beban"), ("5-14", "Beban Obat & Vitamin", "Beban"),
-                    ("6-11", "Beban Transportasi", "Beban"), ("6-12", "Beban Listrik, Air, dan Telepon", "Beban"),
-                    ("6-13", "Beban Penyusutan Kandang", "Beban"), ("6-14", "Beban Penyusutan Kendaraan", "Beban")
-                ]
-                c.executemany("INSERT INTO akun (kode_akun, nama_akun, tipe_akun) VALUES (?,?,?)", real_accounts)
-            
-           
-            if not c.execute("SELECT * FROM inventory").fetchone():
-                real_inv = [
-                    ("PKN-MERAH", "Pakan Kukila Merah", "Pakan", "Sak", 0, 5, "Persediaan Pakan Ternak", "Beban Pakan", 360000),
-                    ("PKN-BIRU", "Pakan Kukila Biru", "Pakan", "Sak", 0, 5, "Persediaan Pakan Ternak", "Beban Pakan", 435000),
-                    ("TELUR", "Telur Puyuh", "Produk", "Dus", 0, 10, "Persediaan Telur Puyuh", "HPP Telur Puyuh", 285000),
-                    ("PUPUK", "Pupuk Organik (Kotoran)", "Produk", "Sak", 0, 5, "Persediaan Kotoran (Pupuk)", "HPP Kotoran (Pupuk)", 5000),
-                    ("VIT-OBAT", "Vitamin & Obat", "Obat", "Paket", 0, 2, "Persediaan Obat & Vitamin", "Beban Obat & Vitamin", 100000)
-                ]
-                
-                c.executemany("INSERT INTO inventory (kode_barang, nama_barang, kategori, satuan, stok_saat_ini, min_stok, akun_aset, akun_hpp, std_cost) VALUES (?,?,?,?,?,?,?,?,?)", real_inv)
-            
+    @contextmanager
+    def timed(self, q, p=()):
+        # Semua statement dicatat ke QueryStats lewat sini. Pemanggil mengisi rec["rows"],
+        # rec["cached"], atau rec["ms"] bila hanya sebagian waktu blok yang milik database.
+        rec = {"rows": 0, "cached": False}
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        except Exception as e:
+            self.stats.record(q, p, (time.perf_counter() - t0) * 1000, 0, e)
+            raise
+        self.stats.record(q, p, rec.get("ms", (time.perf_counter() - t0) * 1000), rec["rows"], None, rec["cached"])
+
+    def get_inventory_card_df(self, kode_barang, method="standard"):
+        logs = self.get_df_cached(SQL_STOCK_CARD, (kode_barang,))
+        r = self.get_one(SQL_STD_COST, (kode_barang,))
+        std_price = float(r[0]) if r and r[0] else 0.0
+        return compute_stock_card(logs, std_price, method)
+
+    def init_db(self):
+        c = self._timed_conn()
+        if c.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            ver = c.execute("PRAGMA user_version").fetchone()[0]
+            for num, step in enumerate(MIGRATIONS[ver:], start=ver + 1):
+                step(c)
+                c.execute(f"PRAGMA user_version = {num}")
+                logging.info(f"SYSTEM|MIGRATE|{num:03d} {step.__name__}")
             c.commit()
+        except Exception:
+            c.rollback()
+            raise
+
     def run_query(self, q, p=()):
         q = q.replace('%s', '?')
         try:
-            with self._conn() as c:
-                c.execute(q, p)
+            with self.timed(q, p) as rec, self._conn() as c:
+                rec["rows"] = max(c.execute(q, p).rowcount, 0)
                 c.commit()
             return True
         except Exception as e:
@@ -334,56 +1527,677 @@ class DatabaseManager:
     def get_df(self, q, p=()):
         q = q.replace('%s', '?')
         try:
-            with self._conn() as c:
-                return pd.read_sql_query(q, c, params=p)
-        except:
+            with self.timed(q, p) as rec, self._conn() as c:
+                df = pd.read_sql_query(q, c, params=p)
+                rec["rows"] = len(df)
+        except Exception:
+            # tetap kembalikan DataFrame kosong agar halaman tidak pecah, tapi error tercatat di log
             return pd.DataFrame()
+        return df
     
+    def get_df_cached(self, q, p=()):
+        # Sama dengan get_df, tapi hasil dibagi lewat QueryCache selama write_seq belum berubah.
+        q = q.replace('%s', '?')
+        try:
+            with self._conn() as c:
+                with self.timed(SQL_WRITE_SEQ) as rec:
+                    key = (q, tuple(p), c.execute(SQL_WRITE_SEQ).fetchone()[0])
+                    rec["rows"] = 1
+                with self.timed(q, p) as rec:
+                    df = self.cache.get(key)
+                    rec["cached"] = df is not None
+                    if df is None:
+                        df = pd.read_sql_query(q, c, params=p)
+                        self.cache.put(key, df)
+                    rec["rows"] = len(df)
+        except Exception:
+            return pd.DataFrame()
+        return df.copy()
+
     def get_one(self, q, p=()):
         q = q.replace('%s', '?')
-        with self._conn() as c:
-            return c.execute(q, p).fetchone()
+        with self.timed(q, p) as rec, self._conn() as c:
+            r = c.execute(q, p).fetchone()
+            rec["rows"] = int(r is not None)
+        return r
     
+    def explain(self, q, p=()):
+        q = q.replace('%s', '?')
+        return [r['detail'] for r in self._timed_conn().execute("EXPLAIN QUERY PLAN " + q, p).fetchall()]
+
+    def audit_query_plans(self, queries=None):
+        rows = []
+        for name, (q, p) in (queries or HOT_QUERIES).items():
+            plan = self.explain(q, p)
+            scans = full_scans(plan, q)
+            rows.append({"query": name, "plan": " | ".join(plan), "full_scan": bool(scans)})
+        return pd.DataFrame(rows)
+
+    def _coa(self):
+        return self.coa.load(self._timed_conn())
+
     def get_acc_by_type(self, types):
-        ph = ','.join(['?']*len(types))
-        df = self.get_df(f"SELECT nama_akun FROM akun WHERE tipe_akun IN ({ph})", tuple(types))
-        return df['nama_akun'].tolist() if not df.empty else []
+        by_type = self._coa()["by_type"]
+        if len(types) == 1:
+            return list(by_type.get(types[0], []))
+        by_name = self._coa()["by_name"]
+        return sorted((n for t in types for n in by_type.get(t, [])), key=lambda n: by_name[n]["id"])
     
     def get_all_acc(self):
-        df = self.get_df("SELECT nama_akun FROM akun ORDER BY kode_akun")
-        return df['nama_akun'].tolist() if not df.empty else []
+        return list(self._coa()["names"])
+
+    def get_akun(self, nama_akun):
+        return self._coa()["by_name"].get(nama_akun)
+
+    def get_akun_by_kode(self, kode_akun):
+        return self._coa()["by_code"].get(kode_akun)
+
+    def get_coa_df(self):
+        return pd.DataFrame([self._coa()["by_name"][n] for n in self._coa()["names"]], columns=["id", "kode_akun", "nama_akun", "tipe_akun"])
+
+    def get_account_balances(self, start=None, end=None, exclude_closing=False):
+        # Tanpa periode: dari account_balance. Dengan periode: selisih saldo kumulatif harian
+        # (periode yang mulai tepat setelah tutup buku memakai saldo_tutup sebagai saldo awal).
+        if start is None and end is None and not exclude_closing:
+            return self.get_df_cached(SQL_ACCOUNT_BALANCES)
+        bal = self.get_df_cached(SQL_BALANCES_UNTIL, (end, end)) if end is not None else self.get_df_cached(SQL_ACCOUNT_BALANCES)
+        if start is not None and not bal.empty:
+            prev = self.closing_before(start)
+            before = self.get_df_cached(SQL_SALDO_TUTUP, (prev,)) if prev else self.get_df_cached(SQL_BALANCES_BEFORE, (start, start))
+            bal[['debit', 'kredit']] = bal[['debit', 'kredit']].to_numpy() - before[['debit', 'kredit']].to_numpy()
+        if exclude_closing and self.get_closing_dates() and not bal.empty:
+            pen = self.get_df_cached(SQL_CLOSING_TOTALS, (str(start or ""), str(end or "9999-12-31")))
+            bal[['debit', 'kredit']] = bal[['debit', 'kredit']].to_numpy() - pen[['debit', 'kredit']].to_numpy()
+        return bal
+
+    def get_closing_dates(self):
+        return self.get_df_cached(SQL_CLOSING_DATES)['sampai'].tolist()
+
+    def closing_before(self, tgl):
+        # Tanggal tutup buku tepat sehari sebelum `tgl`, kalau ada.
+        prev = str(date.fromisoformat(str(tgl)[:10]) - timedelta(days=1))
+        return prev if prev in self.get_closing_dates() else None
+
+    def get_open_period_start(self):
+        tutup = self.get_closing_dates()
+        return date.fromisoformat(tutup[-1]) + timedelta(days=1) if tutup else None
+
+    def get_balance_before(self, nama_akun, tgl):
+        prev = self.closing_before(tgl)
+        if prev:
+            r = self.get_one(SQL_SALDO_TUTUP_AKUN, (prev, nama_akun))
+        else:
+            r = self.get_one(SQL_DAILY_BEFORE_AKUN, (nama_akun, tgl))
+        return (r[0], r[1]) if r else (0, 0)
+
+    def get_date_bounds(self):
+        lo = self.get_one(SQL_DATE_MIN)[0]
+        hi = self.get_one(SQL_DATE_MAX)[0]
+        try:
+            return date.fromisoformat(lo[:10]), max(date.fromisoformat(hi[:10]), date.today())
+        except (TypeError, ValueError):
+            return date.today(), date.today()
+
+    def get_receipts(self, dari=None, sampai=None, f_mode="Semua", ids=None):
+        if ids is not None:
+            return self.get_df(SQL_RECEIPTS_IDS, (f"[{','.join(map(str, ids))}]",))
+        return self.get_df(SQL_RECEIPTS_RANGE.format(filt=jurnal_filter_prefix(f_mode)), (str(dari), f"{sampai} 23:59:59"))
+
+    def search_count(self, text, sumber="jurnal"):
+        q = fts_query(text)
+        if not q:
+            return 0
+        fts = "stock_log_fts" if sumber == "stock_log" else "jurnal_fts"
+        return self.get_one(SQL_SEARCH_COUNT.format(fts=fts), (q,))[0]
+
+    def search(self, text, sumber="jurnal", page=1):
+        # Ranking butuh semua match, jadi halaman memakai OFFSET atas hasil yang sudah terurut.
+        q = fts_query(text)
+        if not q:
+            return pd.DataFrame()
+        sql = SQL_SEARCH_STOCK_LOG if sumber == "stock_log" else SQL_SEARCH_JURNAL
+        return self.get_df_cached(sql, (q, SEARCH_PAGE_SIZE, (page - 1) * SEARCH_PAGE_SIZE))
+
+    def get_cashflow_series(self, time_mode="Harian"):
+        grain = time_mode.lower() if time_mode.lower() in ROLLUP_GRAINS else "harian"
+        return self.get_df_cached(SQL_DASH_CASHFLOW, (grain,))
+
+    def get_expense_composition(self):
+        return self.get_df_cached(SQL_DASH_EXPENSE)
+
+    def count_low_stock(self):
+        return self.get_one(SQL_LOW_STOCK_COUNT)[0]
+
+    def get_balance(self, nama_akun):
+        r = self.get_one(SQL_BALANCE_AKUN, (nama_akun,))
+        return r[0] if r else 0
+
+    def rebuild_balances(self):
+        with self._timed_conn() as c:
+            rebuild_derived(c)
+            c.execute("UPDATE write_seq SET seq = seq + 1 WHERE id = 1")
+
+    def check_account_balance(self, tol=0):
+        fresh = self.get_df(SQL_JURNAL_TOTALS)
+        stored = self.get_df(SQL_BALANCE_STORED)
+        daily = self.get_df(SQL_DAILY_LATEST)
+        rollup = self.get_df(SQL_ROLLUP_YEAR_TOTALS)
+        penutup = self.get_df(SQL_PENUTUP_TOTALS)
+        m = fresh.merge(stored, on='akun_id', how='outer', suffixes=('_jurnal', '_tabel')).merge(daily, on='akun_id', how='outer') \
+            .merge(rollup, on='akun_id', how='outer').merge(penutup, on='akun_id', how='outer').fillna(0)
+        coa = self.get_coa_df()
+        m.insert(1, 'nama_akun', m['akun_id'].map(dict(zip(coa['id'], coa['nama_akun']))))
+        bad = ((m['debit_jurnal'] - m['debit_tabel']).abs() > tol) | ((m['kredit_jurnal'] - m['kredit_tabel']).abs() > tol) \
+            | ((m['debit_jurnal'] - m['debit_harian']).abs() > tol) | ((m['kredit_jurnal'] - m['kredit_harian']).abs() > tol) \
+            | ((m['debit_jurnal'] - m['debit_penutup'] - m['debit_rollup']).abs() > tol) \
+            | ((m['kredit_jurnal'] - m['kredit_penutup'] - m['kredit_rollup']).abs() > tol)
+        return m[bad].reset_index(drop=True)
+
+class PostingError(Exception):
+    pass
+
+class SaleEvent(BaseModel):
+    tanggal: date
+    kode_barang: str
+    nama_barang: str
+    qty: float = Field(..., gt=0)
+    harga: float
+    keterangan: str = ""
+    akun_debit: str
+    akun_kredit: str
+    user: str
+    deskripsi: Optional[str] = None
+
+class PurchaseEvent(BaseModel):
+    tanggal: date
+    kode_barang: str
+    nama_barang: str
+    qty: float = Field(..., gt=0)
+    total: float
+    keterangan: str = ""
+    akun_kredit: str
+    user: str
+    deskripsi: Optional[str] = None
+    akun_debit: Optional[str] = None
+
+class ExpenseEvent(BaseModel):
+    tanggal: date
+    deskripsi: str
+    akun_debit: str
+    akun_kredit: str
+    nominal: float
+    user: str
+    jenis: Optional[str] = None
+
+class OpeningBalanceEvent(BaseModel):
+    tanggal: date
+    deskripsi: str
+    akun: str
+    posisi: str = "Debit"
+    nominal: float
+    user: str
+    kode_barang: Optional[str] = None
+    qty: float = 0
+    harga_satuan: float = 0
+
+class DeleteJurnalEvent(BaseModel):
+    jurnal_id: int
+    user: str
+    kode_barang: Optional[str] = None
+    qty: float = 0
+    jenis_koreksi: str = "IN"
+
+class ClosingEvent(BaseModel):
+    sampai: date
+    akun_modal: str
+    user: str
+
+class ResetTransaksiEvent(BaseModel):
+    user: str
+
+def jenis_jurnal_umum(db, akun_debit, akun_kredit):
+    # Jurnal umum tanpa barang: dibedakan dari tipe akun di bagan akun.
+    tipe_d = (db.get_akun(akun_debit) or {}).get('tipe_akun')
+    tipe_k = (db.get_akun(akun_kredit) or {}).get('tipe_akun')
+    if tipe_k == 'Pendapatan':
+        return "JUAL"
+    return "BIAYA" if tipe_d == 'Beban' else "UMUM"
+
+class PostingService:
+    # Satu event bisnis (atau satu batch event) = satu transaksi, satu commit.
+    OPENING_CONTRA = "Historical Balancing"
+
+    def __init__(self, db):
+        self.db = db
+
+    def post(self, events):
+        events = [events] if isinstance(events, BaseModel) else list(events)
+        c = self.db._timed_conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for ev in events:
+                getattr(self, f"_post_{type(ev).__name__}")(c, ev)
+            c.commit()
+        except Exception:
+            c.rollback()
+            raise
+        return len(events)
 
-db = DatabaseManager("hasna_real_data.db")
-db.init_db()
+    def _jurnal(self, c, tanggal, deskripsi, debit, kredit, nominal, user, jenis):
+        nominal = rupiah(nominal)
+        try:
+            JurnalSchema(tanggal=tanggal, deskripsi=deskripsi, akun_debit=debit, akun_kredit=kredit, nominal=nominal, created_by=user)
+        except ValidationError as e:
+            raise PostingError(f"Jurnal tidak valid ({deskripsi}): {e.errors()[0]['msg']}")
+        if jenis not in JENIS_JURNAL:
+            raise PostingError(f"Jenis transaksi tidak dikenal: {jenis}")
+        try:
+            c.execute(SQL_INSERT_JURNAL, (tanggal, deskripsi, debit, kredit, nominal, user, jenis))
+        except sqlite3.IntegrityError as e:
+            raise PostingError(f"{e} ({debit} / {kredit})")
+
+    def _stock(self, c, tanggal, kode, gerak, qty, harga, ket, user):
+        delta = qty if gerak == "IN" else -qty
+        c.execute("UPDATE inventory SET stok_saat_ini=stok_saat_ini+? WHERE kode_barang=?", (delta, kode))
+        c.execute(SQL_INSERT_STOCK_LOG, (tanggal, kode, gerak, qty, rupiah(harga), ket, user))
+
+    def _post_SaleEvent(self, c, ev):
+        cur = c.execute("SELECT stok_saat_ini, akun_aset, akun_hpp, std_cost FROM inventory WHERE kode_barang=?", (ev.kode_barang,)).fetchone()
+        if not cur:
+            raise PostingError(f"Barang {ev.kode_barang} tidak ditemukan!")
+        stok_db, acc_aset, acc_hpp, std_cost = cur
+        if ev.qty > stok_db:
+            raise PostingError("Stok Kurang!")
+        harga_pokok = std_cost if std_cost else 0
+        self._stock(c, ev.tanggal, ev.kode_barang, "OUT", ev.qty, harga_pokok, f"Sold: {ev.keterangan}", ev.user)
+        self._jurnal(c, ev.tanggal, ev.deskripsi or f"JUAL {ev.nama_barang}: {ev.keterangan}", ev.akun_debit, ev.akun_kredit, ev.qty * ev.harga, ev.user, "JUAL")
+        nilai_hpp = ev.qty * harga_pokok
+        if nilai_hpp > 0 and acc_aset and acc_hpp:
+            self._jurnal(c, ev.tanggal, f"Cost of Goods Sold (Ref: {ev.nama_barang})", acc_hpp, acc_aset, nilai_hpp, ev.user, "HPP")
+
+    def _post_PurchaseEvent(self, c, ev):
+        cur = c.execute("SELECT akun_aset FROM inventory WHERE kode_barang=?", (ev.kode_barang,)).fetchone()
+        akun_aset = cur[0] if cur and cur[0] else "Persediaan (Umum)"
+        self._stock(c, ev.tanggal, ev.kode_barang, "IN", ev.qty, ev.total / ev.qty, f"Buy: {ev.keterangan}", ev.user)
+        self._jurnal(c, ev.tanggal, ev.deskripsi or f"BELI {ev.nama_barang}: {ev.keterangan}", ev.akun_debit or akun_aset, ev.akun_kredit, ev.total, ev.user, "BELI")
+
+    def _post_ExpenseEvent(self, c, ev):
+        jenis = ev.jenis or jenis_jurnal_umum(self.db, ev.akun_debit, ev.akun_kredit)
+        self._jurnal(c, ev.tanggal, ev.deskripsi, ev.akun_debit, ev.akun_kredit, ev.nominal, ev.user, jenis)
+
+    def _post_OpeningBalanceEvent(self, c, ev):
+        if ev.posisi == "Debit":
+            adb, acr = ev.akun, self.OPENING_CONTRA
+        else:
+            adb, acr = self.OPENING_CONTRA, ev.akun
+        self._jurnal(c, ev.tanggal, ev.deskripsi, adb, acr, ev.nominal, ev.user, "SALDO_AWAL")
+        if ev.kode_barang and ev.qty > 0:
+            self._stock(c, ev.tanggal, ev.kode_barang, "IN", ev.qty, ev.harga_satuan, "Saldo Awal (Opname)", ev.user)
+
+    def _post_DeleteJurnalEvent(self, c, ev):
+        try:
+            deleted = c.execute("DELETE FROM jurnal_data WHERE id=?", (ev.jurnal_id,)).rowcount
+        except sqlite3.IntegrityError as e:
+            raise PostingError(f"ID {ev.jurnal_id}: {e}")
+        if deleted == 0:
+            raise PostingError("ID Transaksi tidak ditemukan!")
+        if ev.kode_barang and ev.qty > 0:
+            self._stock(c, date.today(), ev.kode_barang, ev.jenis_koreksi, ev.qty, 0, f"Koreksi Hapus ID {ev.jurnal_id}", ev.user)
+
+    def _post_ClosingEvent(self, c, ev):
+        # Pendapatan & Beban s.d. tanggal tutup dinolkan ke akun Modal, saldo akhir disimpan, periode dikunci.
+        sampai = str(ev.sampai)
+        last = c.execute("SELECT MAX(sampai) FROM periode_tutup").fetchone()[0]
+        if last and sampai <= last:
+            raise PostingError(f"Periode s.d. {last} sudah ditutup.")
+        modal = c.execute("SELECT id, tipe_akun FROM akun WHERE nama_akun=?", (ev.akun_modal,)).fetchone()
+        if not modal or modal[1] != "Modal":
+            raise PostingError("Akun penutup harus akun bertipe Modal.")
+        for r in c.execute(SQL_BALANCES_UNTIL, (sampai, sampai)).fetchall():
+            net = r['debit'] - r['kredit'] if r['tipe_akun'] in TIPE_NOMINAL else 0
+            if net:
+                adb, acr = (ev.akun_modal, r['nama_akun']) if net > 0 else (r['nama_akun'], ev.akun_modal)
+                self._jurnal(c, sampai, f"Tutup buku s.d. {sampai}: {r['nama_akun']}", adb, acr, abs(net), ev.user, "PENUTUP")
+        c.execute(SQL_SALDO_TUTUP_SNAPSHOT, (sampai, sampai, sampai))
+        c.execute("INSERT INTO periode_tutup (sampai, akun_modal_id, created_by) VALUES (?,?,?)", (sampai, modal[0], ev.user))
+
+    def _post_ResetTransaksiEvent(self, c, ev):
+        # Satu transaksi: gagal di tengah = tidak ada yang terhapus. periode_tutup dulu agar trigger kunci periode lepas.
+        for sql in ("DELETE FROM periode_tutup", "DELETE FROM saldo_tutup", "DELETE FROM jurnal_data",
+                    "DELETE FROM stock_log", "UPDATE inventory SET stok_saat_ini = 0"):
+            c.execute(sql)
+
+IMPORT_COLUMNS = ["tanggal", "deskripsi", "akun_debit", "akun_kredit", "nominal", "kode_barang", "qty", "jenis"]
+IMPORT_CHUNK_SIZE = 5000
+JURNAL_LIST = TypeAdapter(List[JurnalSchema])
+
+def read_import_chunks(file, name, chunksize=IMPORT_CHUNK_SIZE):
+    # Baca CSV/XLSX per potongan agar file besar tidak dimuat sekaligus.
+    if name.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+        ws = load_workbook(file, read_only=True, data_only=True).active
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip().lower() if h is not None else "" for h in next(rows, ())]
+        buf = []
+        for r in rows:
+            if any(v is not None and v != "" for v in r):
+                buf.append(r)
+            if len(buf) >= chunksize:
+                yield pd.DataFrame(buf, columns=header)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=header)
+    else:
+        for chunk in pd.read_csv(file, chunksize=chunksize, dtype=str, keep_default_na=False):
+            chunk.columns = [str(col).strip().lower() for col in chunk.columns]
+            yield chunk
+
+class JurnalImporter:
+    # Validasi massal per chunk, lalu satu PostingService.post per chunk (satu transaksi, aturan posting sama dengan form).
+    def __init__(self, db, user):
+        self.db = db
+        self.user = user
+        akun = db.get_coa_df()
+        self.acc_map = {str(k).strip().lower(): n for k, n in zip(akun['kode_akun'], akun['nama_akun'])}
+        self.acc_map.update({n.strip().lower(): n for n in akun['nama_akun']})
+        self.pendapatan = set(akun.loc[akun['tipe_akun'] == 'Pendapatan', 'nama_akun'])
+        self.beban = set(akun.loc[akun['tipe_akun'] == 'Beban', 'nama_akun'])
+        inv = db.get_df("SELECT kode_barang, nama_barang, stok_saat_ini FROM inventory")
+        self.item_map = {str(k).strip().lower(): k for k in inv['kode_barang']}
+        self.item_map.update({str(n).strip().lower(): k for k, n in zip(inv['kode_barang'], inv['nama_barang'])})
+        self.nama_barang = dict(zip(inv['kode_barang'], inv['nama_barang']))
+        self.stok = dict(zip(inv['kode_barang'], inv['stok_saat_ini'].fillna(0).astype(float)))
+        self.tutup = (db.get_closing_dates() or [None])[-1]
+        self.total_ok = 0
+        self.rejected = []
+
+    def import_chunk(self, chunk, offset=0):
+        df = chunk.reindex(columns=IMPORT_COLUMNS)
+        txt = lambda col: df[col].fillna("").astype(str).str.strip()
+        alasan = pd.Series("", index=df.index)
+        def tolak(mask, msg):
+            alasan[mask] = alasan[mask] + msg + "; "
+
+        debit = txt('akun_debit').str.lower().map(self.acc_map)
+        kredit = txt('akun_kredit').str.lower().map(self.acc_map)
+        tolak(debit.isna(), "Akun debit tidak dikenal")
+        tolak(kredit.isna(), "Akun kredit tidak dikenal")
+        # ISO (YYYY-MM-DD) dulu, sisanya format lokal DD/MM/YYYY
+        tgl = pd.to_datetime(df['tanggal'], errors='coerce', format="ISO8601")
+        tgl = tgl.fillna(pd.to_datetime(df['tanggal'], errors='coerce', format="mixed", dayfirst=True))
+        if self.tutup:
+            tolak(tgl.dt.strftime('%Y-%m-%d') <= self.tutup, f"Periode s.d. {self.tutup} sudah ditutup")
+        nominal = pd.to_numeric(df['nominal'], errors='coerce').round()
+        deskripsi = txt('deskripsi')
+
+        kode_in = txt('kode_barang')
+        has_item = kode_in != ""
+        kode = kode_in.str.lower().map(self.item_map)
+        qty = pd.to_numeric(df['qty'], errors='coerce')
+        tolak(has_item & kode.isna(), "Kode barang tidak dikenal")
+        tolak(has_item & ~(qty > 0), "Qty barang harus > 0")
+
+        # Kolom jenis opsional; kosong -> disimpulkan dengan aturan yang sama seperti form.
+        # Baris barang selalu JUAL/BELI (dari akun kredit), karena diposting sebagai penjualan/pembelian.
+        jenis_in = txt('jenis').str.upper()
+        tolak((jenis_in != "") & ~jenis_in.isin(JENIS_JURNAL), "Jenis transaksi tidak dikenal")
+        jual = kredit.isin(self.pendapatan)
+        jenis = pd.Series(np.select([has_item & jual, has_item, jual, debit.isin(self.beban)], ["JUAL", "BELI", "JUAL", "BIAYA"], "UMUM"), index=df.index)
+        tolak(has_item & (jenis_in != "") & (jenis_in != jenis), "Baris barang hanya bisa berjenis JUAL/BELI sesuai akun kredit")
+        jenis = jenis.where(jenis_in == "", jenis_in)
+
+        records = [
+            {"tanggal": t.date() if pd.notna(t) else None, "deskripsi": d, "akun_debit": ad if isinstance(ad, str) else "",
+             "akun_kredit": ak if isinstance(ak, str) else "", "nominal": n, "created_by": self.user}
+            for t, d, ad, ak, n in zip(tgl, deskripsi, debit, kredit, nominal)
+        ]
+        try:
+            JURNAL_LIST.validate_python(records)
+        except ValidationError as e:
+            for err in e.errors():
+                i, field = err['loc'][0], err['loc'][1] if len(err['loc']) > 1 else ""
+                alasan.iloc[i] += f"{field}: {err['msg']}; "
+
+        # Stok berjalan per barang (urutan baris file): penjualan yang membuat stok minus ditolak per baris.
+        events = []
+        stok = dict(self.stok)
+        rows = zip(alasan == "", tgl.dt.date, deskripsi, debit, kredit, nominal, has_item, kode, qty, jenis)
+        for i, (valid, t, d, ad, ak, n, brg, kd, q, j) in enumerate(rows):
+            if not valid:
+                continue
+            if not brg:
+                events.append(ExpenseEvent(tanggal=t, deskripsi=d, akun_debit=ad, akun_kredit=ak, nominal=n, user=self.user, jenis=j))
+                continue
+            nama, q = self.nama_barang[kd], float(q)
+            if ak in self.pendapatan:
+                if q > stok[kd]:
+                    alasan.iloc[i] += f"Stok {nama} kurang (tersisa {stok[kd]:g}); "
+                    continue
+                stok[kd] -= q
+                events.append(SaleEvent(tanggal=t, kode_barang=kd, nama_barang=nama, qty=q, harga=n / q, keterangan=d, deskripsi=d,
+                                        akun_debit=ad, akun_kredit=ak, user=self.user))
+            else:
+                stok[kd] += q
+                events.append(PurchaseEvent(tanggal=t, kode_barang=kd, nama_barang=nama, qty=q, total=n, keterangan=d, deskripsi=d,
+                                            akun_debit=ad, akun_kredit=ak, user=self.user))
+
+        ok = alasan == ""
+        if (~ok).any():
+            bad = chunk.loc[~ok].copy()
+            bad.insert(0, 'baris', (offset + 2 + np.flatnonzero(~ok.to_numpy())))
+            bad['alasan'] = alasan[~ok].str.rstrip("; ")
+            self.rejected.append(bad)
+        if not events:
+            return 0
+
+        PostingService(self.db).post(events)
+        self.stok = stok
+        self.total_ok += len(events)
+        return len(events)
+
+    def rejected_df(self):
+        return pd.concat(self.rejected, ignore_index=True) if self.rejected else pd.DataFrame()
+
+EXPORT_CHUNK_SIZE = 5000
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def export_xlsx(db, sql, params=(), sheet="Data", money_cols=(), date_cols=("tanggal",), chunksize=EXPORT_CHUNK_SIZE):
+    # constant_memory: tiap baris langsung di-flush ke file sementara; data dari SQLite dibaca per chunk.
+    import xlsxwriter
+    out = io.BytesIO()
+    wb = xlsxwriter.Workbook(out, {'constant_memory': True})
+    ws = wb.add_worksheet(sheet)
+    f_head = wb.add_format({'bold': True, 'bg_color': '#f4f6e6', 'bottom': 1})
+    f_money = wb.add_format({'num_format': '#,##0'})
+    f_date = wb.add_format({'num_format': 'dd/mm/yyyy'})
+
+    with db.timed(sql, params) as rec:
+        # yang dicatat hanya waktu baca dari SQLite, bukan waktu menulis workbook
+        t0 = time.perf_counter()
+        cur = db._conn().execute(sql, params)
+        db_ms = time.perf_counter() - t0
+        cols = [d[0] for d in cur.description]
+        fmts = [f_money if c in money_cols else f_date if c in date_cols else None for c in cols]
+        for i, c in enumerate(cols):
+            ws.set_column(i, i, 40 if c in ("deskripsi", "keterangan") else 16)
+        ws.freeze_panes(1, 0)
+        ws.write_row(0, 0, cols, f_head)
+
+        r = 1
+        while True:
+            t0 = time.perf_counter()
+            rows = cur.fetchmany(chunksize)
+            db_ms += time.perf_counter() - t0
+            if not rows:
+                break
+            for row in rows:
+                for c, (v, f) in enumerate(zip(row, fmts)):
+                    if v is None:
+                        continue
+                    if f is f_date:
+                        try:
+                            ws.write_datetime(r, c, datetime.strptime(str(v)[:10], "%Y-%m-%d"), f_date)
+                        except ValueError:
+                            ws.write_string(r, c, str(v))
+                    else:
+                        ws.write(r, c, v, f)
+                r += 1
+        cur.close()
+        rec["rows"] = r - 1
+        rec["ms"] = db_ms * 1000
+    wb.close()
+    return out.getvalue()
+
+@st.cache_resource
+def init_schema(db_name):
+    DatabaseManager(db_name).init_db()
+    return True
+
+# HASNA_DB_PATH: pakai file database lain (mis. data sintetis benchmark_farm.py).
+db = DatabaseManager(os.environ.get("HASNA_DB_PATH", "hasna_real_data.db"))
+init_schema(db.db_name)
+posting = PostingService(db)
+
+RECEIPT_LOGO = "logo.png"
+RECEIPT_LOGO_PX = 300     # dicetak selebar 25 mm: ~300 dpi
+RECEIPT_ASYNC_MIN = 100   # batch di atas ini dibuat di thread latar
+RECEIPT_MAX = 5000
+
+@st.cache_resource
+def get_receipt_logo(path=RECEIPT_LOGO):
+    # FPDF memisahkan kanal alpha PNG RGBA per piksel (Python murni) di tiap dokumen baru. Logo diratakan ke
+    # latar putih sekali per proses dan disimpan sebagai PNG RGB kecil, yang dibaca FPDF tanpa decode.
+    try:
+        from PIL import Image
+        im = Image.open(path).convert("RGBA")
+        im.thumbnail((RECEIPT_LOGO_PX, RECEIPT_LOGO_PX))
+        rgb = Image.new("RGB", im.size, "white")
+        rgb.paste(im, mask=im.getchannel("A"))
+        fd, out = tempfile.mkstemp(prefix="kwitansi_logo_", suffix=".png")
+        with os.fdopen(fd, "wb") as f:
+            rgb.save(f, "PNG")
+        return out
+    except Exception:
+        return None
+
+def pdf_text(v):
+    # Font inti FPDF hanya latin-1; karakter lain diganti '?' agar satu deskripsi tidak menggagalkan batch.
+    return str(v).encode("latin-1", "replace").decode("latin-1")
+
+class ReceiptPDF(FPDF):
+    # Template kwitansi: satu halaman per transaksi. Font inti (Arial) dimuat FPDF sekali per proses.
+    def __init__(self, logo=None):
+        super().__init__()
+        self.logo = logo
+
+    def header(self):
+        if self.logo:
+            self.image(self.logo, 10, 8, 25)
+        self.set_font('Arial', 'B', 14)
+        self.cell(0, 10, 'HASNA FARM ENTERPRISE', 0, 1, 'C')
+        self.ln(10)
+
+    def receipt(self, id_trx, tgl, desc, nominal, debit, kredit):
+        self.add_page()
+        self.set_font("Arial", "", 12)
+        self.cell(0, 10, f"Receipt #{id_trx}", 0, 1, "C")
+        self.ln(5)
+        self.cell(0, 10, f"Date: {tgl} | Amount: Rp {nominal:,.0f}", 0, 1)
+        self.cell(0, 10, pdf_text(f"Desc: {desc}"), 0, 1)
+        self.cell(0, 10, pdf_text(f"Dr: {debit} | Cr: {kredit}"), 0, 1)
 
 def generate_pdf(id_trx, tgl, desc, nominal, debit, kredit):
-    class PDF(FPDF):
-        def header(self):
-            try:
-                self.image('logo.png', 10, 8, 25)
-            except:
-                pass
-            self.set_font('Arial', 'B', 14)
-            self.cell(0, 10, 'HASNA FARM ENTERPRISE', 0, 1, 'C')
-            self.ln(10)
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_font("Arial", "", 12)
-    pdf.cell(0, 10, f"Receipt #{id_trx}", 0, 1, "C")
-    pdf.ln(5)
-    pdf.cell(0, 10, f"Date: {tgl} | Amount: Rp {nominal:,.0f}", 0, 1)
-    pdf.cell(0, 10, f"Desc: {desc}", 0, 1)
-    pdf.cell(0, 10, f"Dr: {debit} | Cr: {kredit}", 0, 1)
+    pdf = ReceiptPDF(get_receipt_logo())
+    pdf.receipt(id_trx, tgl, desc, nominal, debit, kredit)
     return pdf.output(dest="S").encode("latin-1")
 
-def generate_smart_insights(df):
+def generate_receipts(df, as_zip=False, logo=None, progress=None):
+    # df: kolom id, tanggal, deskripsi, nominal, akun_debit, akun_kredit. Tanpa pemanggilan st.*, aman di thread latar.
+    rows = df[['id', 'tanggal', 'deskripsi', 'nominal', 'akun_debit', 'akun_kredit']].itertuples(index=False)
+    if not as_zip:
+        pdf = ReceiptPDF(logo)
+        for i, r in enumerate(rows, 1):
+            pdf.receipt(*r)
+            if progress:
+                progress(i)
+        return pdf.output(dest="S").encode("latin-1")
+    out = io.BytesIO()
+    # PDF sudah terkompresi; ZIP_STORED menghindari deflate ulang
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED) as zf:
+        for i, r in enumerate(rows, 1):
+            pdf = ReceiptPDF(logo)
+            pdf.receipt(*r)
+            zf.writestr(f"Bukti_{r[0]}.pdf", pdf.output(dest="S").encode("latin-1"))
+            if progress:
+                progress(i)
+    return out.getvalue()
+
+def parse_id_list(text):
+    # "12, 15, 20-30" -> [12, 15, 20, ..., 30]
+    ids = set()
+    for part in re.split(r"[,\s]+", text.strip()):
+        if not part:
+            continue
+        m = re.fullmatch(r"(\d+)(?:-(\d+))?", part)
+        if not m:
+            raise ValueError(f"ID tidak valid: {part}")
+        lo, hi = int(m[1]), int(m[2] or m[1])
+        if hi < lo or hi - lo >= RECEIPT_MAX:
+            raise ValueError(f"Rentang ID tidak valid: {part}")
+        ids.update(range(lo, hi + 1))
+        if len(ids) > RECEIPT_MAX:
+            raise ValueError(f"Maksimal {RECEIPT_MAX:,} ID sekali cetak")
+    return sorted(ids)
+
+class ReceiptJobs:
+    # Batch kwitansi besar dikerjakan di thread latar; sesi hanya menyimpan job id dan memantau progres.
+    def __init__(self, max_workers=2, max_jobs=20):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kwitansi")
+        self._seq = 0
+
+    def submit(self, df, as_zip, logo):
+        with self._lock:
+            self._seq += 1
+            job_id = self._seq
+            # buang job lama yang sudah selesai saja; yang masih berjalan tetap bisa dipantau sesinya
+            selesai = [k for k, j in self._jobs.items() if j["future"] is not None and j["future"].done()]
+            for k in selesai[:max(0, len(self._jobs) - self.max_jobs + 1)]:
+                del self._jobs[k]
+            job = self._jobs[job_id] = {"total": len(df), "done": 0, "as_zip": as_zip, "future": None}
+
+        def progress(i):
+            job["done"] = i
+        job["future"] = self._pool.submit(generate_receipts, df, as_zip, logo, progress)
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+@st.cache_resource
+def get_receipt_jobs():
+    return ReceiptJobs()
+
+@st.fragment(run_every=1)
+def receipt_job_progress(job):
+    if job["future"] is not None and job["future"].done():
+        st.rerun()
+    st.progress(job["done"] / max(job["total"], 1), text=f"⏳ Membuat kwitansi {job['done']:,} / {job['total']:,}...")
+
+def generate_smart_insights(bal):
     insights = []
-    if df.empty:
+    if bal.empty or not bal['debit'].any():
         return ["⚠️ Belum ada cukup data."]
     try:
-        kas_m = df[df['akun_debit']=='Kas']['nominal'].sum()
-        kas_k = df[df['akun_kredit']=='Kas']['nominal'].sum()
-        saldo = kas_m - kas_k
+        kas = bal[bal['nama_akun']=='Kas']
+        saldo = (kas['debit'] - kas['kredit']).sum()
         if saldo < 1000000:
             insights.append("⚠️ **Peringatan Kas:** Saldo menipis (< 1 Jt).")
         elif saldo > 50000000:
@@ -391,24 +2205,21 @@ def generate_smart_insights(df):
     except:
         pass
     
-    bbn = db.get_acc_by_type(['Beban'])
-    df_b = df[df['akun_debit'].isin(bbn)]
+    df_b = bal[(bal['tipe_akun'] == 'Beban') & (bal['debit'] > 0)]
     if not df_b.empty:
-        top = df_b.groupby('akun_debit')['nominal'].sum().sort_values(ascending=False).head(1)
-        insights.append(f"ℹ️ **Top Pengeluaran:** {top.index[0]} (Rp {top.values[0]:,.0f}).")
+        top = df_b.sort_values('debit', ascending=False).iloc[0]
+        insights.append(f"ℹ️ **Top Pengeluaran:** {top['nama_akun']} (Rp {top['debit']:,.0f}).")
     return insights
 
-def generate_sankey(df):
-    if df.empty:
+def generate_sankey(bal):
+    if bal.empty:
         return None
-    pdp = db.get_acc_by_type(['Pendapatan'])
-    bbn = db.get_acc_by_type(['Beban'])
     
-    df_in = df[df['akun_kredit'].isin(pdp)].groupby('akun_kredit')['nominal'].sum().reset_index()
+    df_in = bal.loc[(bal['tipe_akun'] == 'Pendapatan') & (bal['kredit'] > 0), ['nama_akun', 'kredit']].sort_values('nama_akun')
     df_in.columns = ['S','V']
     df_in['T'] = 'Kas Utama'
     
-    df_out = df[df['akun_debit'].isin(bbn)].groupby('akun_debit')['nominal'].sum().reset_index()
+    df_out = bal.loc[(bal['tipe_akun'] == 'Beban') & (bal['debit'] > 0), ['nama_akun', 'debit']].sort_values('nama_akun')
     df_out.columns = ['T','V']
     df_out['S'] = 'Kas Utama'
     
@@ -431,6 +2242,44 @@ def login_required(func):
         return func(*args, **kwargs)
     return wrapper
 
+def profiled(func):
+    # Waktu total halaman + bagian bernama (lihat profile_lap). Sisa waktu setelah lap terakhir dihitung "render".
+    # Jika session_state['profile_next_rerun'] diset, satu rerun halaman ini direkam cProfile ke PROFILE_DIR.
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        page = func.__name__
+        page_context.page = page
+        page_context.laps = {}
+        prof = cProfile.Profile() if st.session_state.pop('profile_next_rerun', False) else None
+        t0 = page_context.t_lap = time.perf_counter()
+        if prof:
+            prof.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if prof:
+                prof.disable()
+            now = time.perf_counter()
+            laps = page_context.laps
+            if laps:
+                laps["render"] = laps.get("render", 0.0) + (now - page_context.t_lap) * 1000
+            for section, ms in laps.items():
+                profiler.record(page, section, ms)
+            profiler.record(page, "total", (now - t0) * 1000)
+            if prof:
+                profiler.dump(page, prof)
+            page_context.page = page_context.laps = None
+    return wrapper
+
+def profile_lap(section):
+    # Waktu sejak lap sebelumnya (atau awal halaman) dimasukkan ke bagian `section`.
+    laps = getattr(page_context, "laps", None)
+    if laps is None:
+        return
+    now = time.perf_counter()
+    laps[section] = laps.get(section, 0.0) + (now - page_context.t_lap) * 1000
+    page_context.t_lap = now
+
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
 if 'username' not in st.session_state:
@@ -439,6 +2288,7 @@ if 'role' not in st.session_state:
     st.session_state['role'] = ""
 
 @login_required
+@profiled
 def page_dashboard():
     st.title("Dashboard Overview")
     
@@ -477,31 +2327,30 @@ def page_dashboard():
     """, unsafe_allow_html=True)
     # -------------------------------------------------------------
 
-    df = db.get_df("SELECT * FROM jurnal ORDER BY tanggal ASC")
-    if not df.empty:
-        df['tanggal_dt'] = pd.to_datetime(df['tanggal'])
+    bal = db.get_account_balances()
+    profile_lap("load")
     
     st.subheader("🤖 AI Business Insights")
     with st.expander("Lihat Analisis Bisnis", expanded=True):
-        saran_list = generate_smart_insights(df)
+        saran_list = generate_smart_insights(bal)
+        profile_lap("compute")
         for saran in saran_list:
             st.markdown(saran)
     st.markdown("<br>", unsafe_allow_html=True)
 
-    pdp = db.get_acc_by_type(['Pendapatan'])
-    bbn = db.get_acc_by_type(['Beban'])
     rev=0
     exp=0
     laba=0
     kas=0
     
-    if not df.empty:
-        rev = df[df['akun_kredit'].isin(pdp)]['nominal'].sum()
-        exp = df[df['akun_debit'].isin(bbn)]['nominal'].sum()
+    if not bal.empty:
+        rev = bal[bal['tipe_akun'] == 'Pendapatan']['kredit'].sum()
+        exp = bal[bal['tipe_akun'] == 'Beban']['debit'].sum()
         laba = rev - exp
-        kas = df[df['akun_debit'] == 'Kas']['nominal'].sum() - df[df['akun_kredit'] == 'Kas']['nominal'].sum()
+        kas = db.get_balance('Kas')
     
-    low_stock = len(db.get_df("SELECT * FROM inventory WHERE stok_saat_ini <= min_stok"))
+    low_stock = db.count_low_stock()
+    profile_lap("load")
 
     c1, c2, c3, c4 = st.columns(4)
     val_rev = f"Rp {rev/1000000:.1f} Jt".replace('.', ',')
@@ -518,25 +2367,17 @@ def page_dashboard():
     with c_title:
         st.subheader("📊 Analisis Grafik")
     with c_filter:
-        time_mode = st.selectbox("Periode:", ["Harian", "Bulanan", "Tahunan"], label_visibility="collapsed")
+        time_mode = st.selectbox("Periode:", [g.title() for g in ROLLUP_GRAINS], label_visibility="collapsed")
     
-    if not df.empty:
-        if time_mode == "Bulanan":
-            df['periode'] = df['tanggal_dt'].dt.strftime('%Y-%m')
-        elif time_mode == "Tahunan":
-            df['periode'] = df['tanggal_dt'].dt.strftime('%Y')
-        else:
-            df['periode'] = df['tanggal']
+    profile_lap("render")
+    ada_data = bool(db.get_one(SQL_ADA_JURNAL))
+    df_cf = db.get_cashflow_series(time_mode)
+    profile_lap("load")
 
     c_l, c_r = st.columns([2, 1])
     with c_l:
         st.caption(f"Arus Kas ({time_mode})")
-        if not df.empty:
-            df_inc = df[df['akun_kredit'].isin(pdp)].groupby('periode')['nominal'].sum().reset_index()
-            df_inc['Type'] = 'Pemasukan'
-            df_out = df[df['akun_debit'].isin(bbn)].groupby('periode')['nominal'].sum().reset_index()
-            df_out['Type'] = 'Pengeluaran'
-            df_cf = pd.concat([df_inc, df_out])
+        if ada_data:
             fig = px.bar(df_cf, x='periode', y='nominal', color='Type', barmode='group', color_discrete_map={'Pemasukan': '#768209', 'Pengeluaran': '#d32f2f'})
             fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', margin=dict(t=0, b=0))
             st.plotly_chart(fig, use_container_width=True)
@@ -545,7 +2386,7 @@ def page_dashboard():
 
     with c_r:
         st.caption(f"Tren Profit ({time_mode})")
-        if not df.empty:
+        if ada_data:
             df_pv = df_cf.pivot_table(index='periode', columns='Type', values='nominal', aggfunc='sum').fillna(0)
             if 'Pemasukan' not in df_pv:
                 df_pv['Pemasukan']=0
@@ -560,10 +2401,12 @@ def page_dashboard():
 
     st.markdown("<br>", unsafe_allow_html=True)
     st.subheader("🍕 Komposisi Pengeluaran")
-    if not df.empty:
-        df_b = df[df['akun_debit'].isin(bbn)]
+    if ada_data:
+        profile_lap("render")
+        df_b = db.get_expense_composition()
+        profile_lap("load")
         if not df_b.empty:
-            fig_p = px.pie(df_b.groupby('akun_debit')['nominal'].sum().reset_index(), values='nominal', names='akun_debit', hole=0.5, color_discrete_sequence=['#768209', '#8E9926', '#A7B042', '#3B2417', '#5A3A29'])
+            fig_p = px.pie(df_b, values='nominal', names='akun_debit', hole=0.5, color_discrete_sequence=['#768209', '#8E9926', '#A7B042', '#3B2417', '#5A3A29'])
             fig_p.update_layout(height=400, margin=dict(t=20, b=20), paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)')
             st.plotly_chart(fig_p, use_container_width=True)
         else:
@@ -572,6 +2415,7 @@ def page_dashboard():
         st.info("Belum ada data.")
 
 @login_required
+@profiled
 def page_inventory():
     st.title("📦 Inventory Monitoring")
     
@@ -627,7 +2471,7 @@ def page_inventory():
     """, unsafe_allow_html=True)
 
     
-    df_inv = db.get_df("SELECT kode_barang, nama_barang, kategori, satuan, stok_saat_ini, min_stok FROM inventory ORDER BY nama_barang ASC")
+    df_inv = db.get_df_cached("SELECT kode_barang, nama_barang, kategori, satuan, stok_saat_ini, min_stok FROM inventory ORDER BY nama_barang ASC")
     if df_inv.empty:
         st.info("Belum ada data barang."); return
 
@@ -678,9 +2522,16 @@ def page_inventory():
     
     if 'active_item' in st.session_state:
         st.markdown("---"); st.subheader(f"🔍 Riwayat: {st.session_state['active_name']}")
-        df_kartu = db.get_inventory_card_df(st.session_state['active_item'])
+        metode = st.radio("Metode Harga Pokok:", ["Standar", "Rata-rata Bergerak"], horizontal=True, key="kartu_metode")
+        df_kartu = db.get_inventory_card_df(st.session_state['active_item'], "average" if metode == "Rata-rata Bergerak" else "standard")
         
         if not df_kartu.empty:
+            n_hal = -(-len(df_kartu) // STOCK_CARD_PAGE_SIZE)
+            hal = n_hal
+            if n_hal > 1:
+                hal = st.number_input(f"Halaman (1 - {n_hal}, {len(df_kartu):,} baris)", 1, n_hal, n_hal, key=f"kartu_hal_{st.session_state['active_item']}")
+            awal = (hal - 1) * STOCK_CARD_PAGE_SIZE
+
             table_html = """
             <table class="custom-table">
                 <thead>
@@ -688,17 +2539,13 @@ def page_inventory():
                     <tr><th width="10%">Tanggal</th><th width="25%">Keterangan</th><th width="5%">Qty</th><th>Harga</th><th>Total</th><th width="5%">Qty</th><th>Harga</th><th>Total</th><th width="5%">Qty</th><th>Harga</th><th>Total</th></tr>
                 </thead><tbody>"""
             
-            for _, row in df_kartu.iterrows():
-                desc = row.get(('Detail', 'Desc'), '')
-                if desc.strip() in ["Buy:", ""]: desc = '<span style="color:#9ca3af; font-style:italic;">(Pembelian Stok)</span>'
-                elif desc.strip() in ["Sold:", "Sell:"]: desc = '<span style="color:#9ca3af; font-style:italic;">(Penjualan Produk)</span>'
-                
-                table_html += f"""<tr>
-                    <td>{row.get(('Detail', 'Date'), '')}</td><td>{desc}</td>
-                    <td><span class="{'val-in' if row.get(('IN', 'Qty')) else ''}">{row.get(('IN', 'Qty'), '')}</span></td><td style="color:#666">{row.get(('IN', 'Price'), '')}</td><td style="color:#666">{row.get(('IN', 'Total'), '')}</td>
-                    <td><span class="{'val-out' if row.get(('OUT', 'Qty')) else ''}">{row.get(('OUT', 'Qty'), '')}</span></td><td style="color:#666">{row.get(('OUT', 'Price'), '')}</td><td style="color:#666">{row.get(('OUT', 'Total'), '')}</td>
-                    <td class="val-bal">{row.get(('Balance', 'Qty'), '')}</td><td>{row.get(('Balance', 'Price'), '')}</td><td>{row.get(('Balance', 'Total'), '')}</td>
-                </tr>"""
+            if awal:
+                prev = df_kartu.iloc[[awal - 1]].copy()
+                prev[("Detail", "Date")] = ""
+                prev[("Detail", "Desc")] = "Saldo Pindahan"
+                prev[["IN", "OUT"]] = 0
+                table_html += stock_card_rows_html(prev)
+            table_html += stock_card_rows_html(df_kartu.iloc[awal:awal + STOCK_CARD_PAGE_SIZE])
             table_html += "</tbody></table>"
             st.markdown(table_html, unsafe_allow_html=True)
         else: st.info("Belum ada riwayat transaksi.")
@@ -706,7 +2553,44 @@ def page_inventory():
         st.markdown("<br>", unsafe_allow_html=True)
         if st.button("Tutup Detail"): del st.session_state['active_item']; st.rerun()
 
+JURNAL_PAGE_SIZE = 50
+JURNAL_TOP = ("9999-12-31", 1 << 62)
+# Label filter -> kode jenis; lookup kesetaraan di idx_jurnal_jenis (jenis, tanggal, id).
+JURNAL_FILTERS = {
+    "Semua": None,
+    "💰 Penjualan": "JUAL",
+    "🛒 Pembelian": "BELI",
+    "📦 HPP": "HPP",
+    "⚙️ Biaya": "BIAYA",
+    "📝 Umum": "UMUM",
+    "📂 Saldo Awal": "SALDO_AWAL",
+    "🔁 Koreksi": "KOREKSI",
+    "🔒 Penutup": "PENUTUP",
+}
+
+def jurnal_filter_prefix(f_mode):
+    jenis = JURNAL_FILTERS.get(f_mode)
+    return f"jenis = '{jenis}' AND " if jenis else ""
+
+def jurnal_set_cursor(cursor):
+    st.session_state['jurnal_cursor'] = cursor
+
+def jurnal_newer(f_mode, first):
+    # Ambil PAGE_SIZE baris yang lebih baru dari baris teratas halaman ini (ASC), kursor = di atas yang terbaru.
+    rows = db.get_df(SQL_JURNAL_NEWER.format(filt=jurnal_filter_prefix(f_mode)), (first[0], first[1] + 1, JURNAL_PAGE_SIZE + 1))
+    if len(rows) <= JURNAL_PAGE_SIZE:
+        jurnal_set_cursor(JURNAL_TOP)
+    else:
+        top = rows.iloc[JURNAL_PAGE_SIZE - 1]
+        jurnal_set_cursor((top['tanggal'], int(top['id']) + 1))
+
+def jurnal_jump():
+    tgl = st.session_state.get('jurnal_jump_tgl')
+    if tgl:
+        jurnal_set_cursor((tgl.isoformat(), JURNAL_TOP[1]))
+
 @login_required
+@profiled
 def page_jurnal():
     st.title("💸 Financial Journal")
     
@@ -743,9 +2627,10 @@ def page_jurnal():
     inv_df = db.get_df("SELECT kode_barang, nama_barang, stok_saat_ini FROM inventory")
     inv_opts = {f"{r['nama_barang']} (Sisa: {r['stok_saat_ini']})": r['kode_barang'] for _, r in inv_df.iterrows()} if not inv_df.empty else {}
     user_now = st.session_state['username']
+    profile_lap("load")
 
     
-    t1, t2, t3, t4 = st.tabs(["💰 Penjualan", "🛒 Pembelian", "⚙️ Biaya Umum", "📂 Saldo Awal"])
+    t1, t2, t3, t4, t5 = st.tabs(["💰 Penjualan", "🛒 Pembelian", "⚙️ Biaya Umum", "📂 Saldo Awal", "📥 Import"])
     
     with t1:
         with st.form("jual"):
@@ -764,33 +2649,11 @@ def page_jurnal():
         
             if st.form_submit_button("Simpan Penjualan", type="primary"):
                 if brg:
-                    kd = inv_opts[brg]
-                    
-                   
-                    cur_data = db.get_one("SELECT stok_saat_ini, akun_aset, akun_hpp, std_cost FROM inventory WHERE kode_barang=?", (kd,))
-                    stok_db, acc_aset, acc_hpp, std_cost = cur_data
-                    harga_pokok_per_unit = std_cost if std_cost else 0
-                    
-                    if qty > stok_db: st.error("Stok Kurang!"); st.stop()
-                
-                   
-                    nilai_hpp_total = qty * harga_pokok_per_unit
-                
-                   
-                    db.run_query("UPDATE inventory SET stok_saat_ini=stok_saat_ini-? WHERE kode_barang=?", (qty, kd))
-                    
-                   
-                    db.run_query("INSERT INTO stock_log (tanggal, kode_barang, jenis_gerak, jumlah, harga_satuan, keterangan, user) VALUES (?,?,?,?,?,?,?)", 
-                                (tgl, kd, "OUT", qty, harga_pokok_per_unit, f"Sold: {ket}", user_now))
-                
-                    
-                    db.run_query("INSERT INTO jurnal (tanggal, deskripsi, akun_debit, akun_kredit, nominal, created_by) VALUES (?,?,?,?,?,?)", 
-                                (tgl, f"JUAL {brg.split(' (')[0]}: {ket}", adb, acr, tot, user_now))
-                    
-                    if nilai_hpp_total > 0 and acc_aset and acc_hpp:
-                        desc_hpp = f"Cost of Goods Sold (Ref: {brg.split(' (')[0]})"
-                        db.run_query("INSERT INTO jurnal (tanggal, deskripsi, akun_debit, akun_kredit, nominal, created_by) VALUES (?,?,?,?,?,?)", 
-                                    (tgl, desc_hpp, acc_hpp, acc_aset, nilai_hpp_total, user_now))
+                    try:
+                        posting.post(SaleEvent(tanggal=tgl, kode_barang=inv_opts[brg], nama_barang=brg.split(' (')[0], qty=qty, harga=prc,
+                                               keterangan=ket, akun_debit=adb, akun_kredit=acr, user=user_now))
+                    except PostingError as e:
+                        st.error(str(e)); st.stop()
                 
                     st.success("OK - Pendapatan & HPP Tercatat"); time.sleep(1); st.rerun()
 
@@ -834,17 +2697,11 @@ def page_jurnal():
             
             if st.form_submit_button("Simpan Pembelian", type="primary"):
                 if brg_key and target_aset:
-                   
-                    db.run_query("UPDATE inventory SET stok_saat_ini=stok_saat_ini+? WHERE kode_barang=?", (qty, target_kode))
-                    
-                    
-                    harga_satuan = tot/qty if qty > 0 else 0
-                    db.run_query("INSERT INTO stock_log (tanggal, kode_barang, jenis_gerak, jumlah, harga_satuan, keterangan, user) VALUES (?,?,?,?,?,?,?)", 
-                                (tgl, target_kode, "IN", qty, harga_satuan, f"Buy: {ket}", user_now))
-                    
-                    
-                    db.run_query("INSERT INTO jurnal (tanggal, deskripsi, akun_debit, akun_kredit, nominal, created_by) VALUES (?,?,?,?,?,?)", 
-                                (tgl, f"BELI {brg_key.split(' (')[0]}: {ket}", target_aset, acr, tot, user_now))
+                    try:
+                        posting.post(PurchaseEvent(tanggal=tgl, kode_barang=target_kode, nama_barang=brg_key.split(' (')[0], qty=qty, total=tot,
+                                                   keterangan=ket, akun_kredit=acr, user=user_now))
+                    except PostingError as e:
+                        st.error(str(e)); st.stop()
                     
                     st.success("OK - Persediaan Bertambah")
                     time.sleep(1)
@@ -861,8 +2718,13 @@ def page_jurnal():
             adb = c3.selectbox("Debit", all_acc, key="u_db")
             acr = c4.selectbox("Kredit", all_acc, index=1, key="u_cr")
             nom = c5.number_input("Rp", step=1000.0, key="u_nom")
+            koreksi = st.checkbox("Jurnal koreksi / penyesuaian", key="u_koreksi")
             if st.form_submit_button("Simpan", type="primary"):
-                db.run_query("INSERT INTO jurnal (tanggal, deskripsi, akun_debit, akun_kredit, nominal, created_by) VALUES (?,?,?,?,?,?)", (tgl, desc, adb, acr, nom, user_now))
+                try:
+                    posting.post(ExpenseEvent(tanggal=tgl, deskripsi=desc, akun_debit=adb, akun_kredit=acr, nominal=nom, user=user_now,
+                                              jenis="KOREKSI" if koreksi else None))
+                except PostingError as e:
+                    st.error(str(e)); st.stop()
                 st.success("OK"); time.sleep(1); st.rerun()
 
     with t4:
@@ -917,27 +2779,15 @@ def page_jurnal():
             if st.form_submit_button("💾 Simpan Saldo Awal", type="primary"):
                 if nom_total > 0:
                     
-                    contra_acc = "Historical Balancing"
-                    
-                    if posisi == "Debit":
-                        adb, acr = target_acc, contra_acc
-                    else:
-                        adb, acr = contra_acc, target_acc
-                    
-                    db.run_query("INSERT INTO jurnal (tanggal, deskripsi, akun_debit, akun_kredit, nominal, created_by) VALUES (?,?,?,?,?,?)", 
-                                (tgl, ket_input, adb, acr, nom_total, user_now))
+                    is_stok = "Stok Barang" in jenis_sa
+                    try:
+                        posting.post(OpeningBalanceEvent(tanggal=tgl, deskripsi=ket_input, akun=target_acc, posisi=posisi, nominal=nom_total, user=user_now,
+                                                         kode_barang=sel_brg_kode if is_stok else None,
+                                                         qty=qty_fisik if is_stok else 0, harga_satuan=hpp_satuan if is_stok else 0))
+                    except PostingError as e:
+                        st.error(str(e)); st.stop()
                     
-                    
-                    if "Stok Barang" in jenis_sa:
-                       
-                        db.run_query("UPDATE inventory SET stok_saat_ini = stok_saat_ini + ? WHERE kode_barang = ?", (qty_fisik, sel_brg_kode))
-                        
-                        
-                        
-                        desc_log = "Saldo Awal (Opname)"
-                        db.run_query("INSERT INTO stock_log (tanggal, kode_barang, jenis_gerak, jumlah, harga_satuan, keterangan, user) VALUES (?,?,?,?,?,?,?)", 
-                                    (tgl, sel_brg_kode, "IN", qty_fisik, hpp_satuan, desc_log, user_now))
-                        
+                    if is_stok:
                         st.toast(f"Stok {sel_brg_label} bertambah {qty_fisik}!", icon="📦")
 
                     st.success("Data berhasil disimpan & terintegrasi!")
@@ -946,46 +2796,96 @@ def page_jurnal():
                 else:
                     st.error("Nominal/Jumlah tidak boleh 0")
 
+    with t5:
+        st.info("ℹ️ Import massal dari CSV/XLSX. Kolom wajib: tanggal, deskripsi, akun_debit, akun_kredit, nominal (akun boleh kode atau nama). "
+                "Opsional: kode_barang & qty untuk mutasi stok (kredit ke akun Pendapatan = barang keluar, selain itu barang masuk), "
+                f"serta jenis ({', '.join(JENIS_JURNAL)}).")
+        contoh = pd.DataFrame([{"tanggal": date.today().isoformat(), "deskripsi": "JUAL Telur Puyuh: Bu Sri", "akun_debit": "1-11",
+                                "akun_kredit": "Penjualan Telur Puyuh", "nominal": 250000, "kode_barang": "TELUR", "qty": 1}])
+        st.download_button("📄 Template CSV", contoh.to_csv(index=False), "template_import_jurnal.csv", "text/csv", key="btn_tpl_import")
+        up = st.file_uploader("File CSV / XLSX", type=["csv", "xlsx"], key="imp_file")
+        if up is not None and st.button("🚀 Proses Import", type="primary"):
+            importer = JurnalImporter(db, user_now)
+            info = st.empty()
+            dibaca = 0
+            try:
+                for chunk in read_import_chunks(up, up.name):
+                    importer.import_chunk(chunk, dibaca)
+                    dibaca += len(chunk)
+                    info.caption(f"⏳ {dibaca:,} baris diproses...")
+            except Exception as e:
+                st.error(f"Import berhenti di baris ~{dibaca + 2}: {e}")
+            info.empty()
+            ditolak = importer.rejected_df()
+            st.success(f"{importer.total_ok:,} baris jurnal tersimpan dari {dibaca:,} baris file.")
+            log_activity(user_now, "IMPORT", f"{up.name}: {importer.total_ok} ok, {len(ditolak)} ditolak")
+            if not ditolak.empty:
+                st.warning(f"{len(ditolak):,} baris ditolak.")
+                st.dataframe(ditolak.head(100), use_container_width=True, hide_index=True)
+                st.download_button("📥 Laporan Error (CSV)", ditolak.to_csv(index=False), "import_jurnal_error.csv", "text/csv", key="btn_imp_err")
+
    
     st.markdown("---")
-    
-    
+
+    with st.expander("🔎 Cari Transaksi (nama pembeli, barang, catatan)"):
+        s1, s2 = st.columns([3, 1])
+        kata = s1.text_input("Kata kunci", placeholder="Contoh: bu sri telur", key="cari_kata")
+        sumber = s2.radio("Sumber", ["Jurnal", "Log Stok"], horizontal=True, key="cari_sumber")
+        if kata.strip():
+            src = "stock_log" if sumber == "Log Stok" else "jurnal"
+            total = db.search_count(kata, src)
+            if total == 0:
+                st.info("Tidak ada hasil.")
+            else:
+                n_hal = -(-total // SEARCH_PAGE_SIZE)
+                hal = 1
+                if n_hal > 1:
+                    hal = st.number_input(f"Halaman (1 - {n_hal}, {total:,} hasil)", 1, n_hal, 1, key=f"cari_hal_{src}_{kata}")
+                else:
+                    st.caption(f"{total:,} hasil")
+                st.dataframe(db.search(kata, src, page=hal), use_container_width=True, hide_index=True)
+
     c_title, c_filt, c_down = st.columns([2, 1.5, 1])
     with c_title:
         st.subheader("📜 Riwayat Jurnal")
     with c_filt:
-        f_mode = st.selectbox("Filter Kategori:", ["Semua", "💰 Penjualan", "🛒 Pembelian", "⚙️ Umum", "📂 Saldo Awal"], label_visibility="collapsed")
+        f_mode = st.selectbox("Filter Kategori:", list(JURNAL_FILTERS), label_visibility="collapsed",
+                              key="jurnal_filter", on_change=jurnal_set_cursor, args=(JURNAL_TOP,))
     
     
-    query = "SELECT * FROM jurnal"
-    if f_mode == "💰 Penjualan":
-        query += " WHERE deskripsi LIKE 'JUAL%' OR akun_kredit LIKE '%Pendapatan%'"
-    elif f_mode == "🛒 Pembelian":
-        query += " WHERE deskripsi LIKE 'BELI%' OR akun_debit LIKE '%Beban%'"
-    elif f_mode == "⚙️ Umum":
-        query += " WHERE deskripsi NOT LIKE 'JUAL%' AND deskripsi NOT LIKE 'BELI%' AND deskripsi NOT LIKE 'Saldo Awal%'"
-    elif f_mode == "📂 Saldo Awal":
-        query += " WHERE deskripsi LIKE 'Saldo Awal%'"
-    
-    query += " ORDER BY tanggal DESC, id DESC LIMIT 50" 
-    
-    df_j = db.get_df(query)
+    cursor = st.session_state.setdefault('jurnal_cursor', JURNAL_TOP)
+    profile_lap("render")
+    df_j = db.get_df_cached(SQL_JURNAL_PAGE.format(filt=jurnal_filter_prefix(f_mode)), (cursor[0], cursor[1], JURNAL_PAGE_SIZE + 1))
+    ada_lama = len(df_j) > JURNAL_PAGE_SIZE
+    df_j = df_j.iloc[:JURNAL_PAGE_SIZE]
+    profile_lap("load")
+
+    n1, n2, n3, n4 = st.columns([1, 1, 1.2, 1.3])
+    n1.button("⬅️ Lebih Baru", disabled=cursor == JURNAL_TOP, use_container_width=True,
+              on_click=jurnal_newer, args=(f_mode, (df_j['tanggal'].iloc[0], int(df_j['id'].iloc[0])) if not df_j.empty else cursor))
+    n2.button("Lebih Lama ➡️", disabled=not ada_lama, use_container_width=True,
+              on_click=jurnal_set_cursor, args=((df_j['tanggal'].iloc[-1], int(df_j['id'].iloc[-1])) if not df_j.empty else cursor,))
+    n3.date_input("Lompat ke tanggal", value=None, key="jurnal_jump_tgl", on_change=jurnal_jump, label_visibility="collapsed")
+    n4.button("⏮️ Terbaru", disabled=cursor == JURNAL_TOP, use_container_width=True, on_click=jurnal_set_cursor, args=(JURNAL_TOP,))
+    if not df_j.empty:
+        st.caption(f"Menampilkan {df_j['tanggal'].iloc[-1]} s/d {df_j['tanggal'].iloc[0]} ({len(df_j)} baris)")
 
     with c_down:
         
         if not df_j.empty:
-            b = io.BytesIO()
-            with pd.ExcelWriter(b, engine='xlsxwriter') as w: 
-                df_j.to_excel(w, index=False)
-            st.download_button("📥 Excel", b, "jurnal.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key='btn_xls')
+            # Workbook baru dibuat saat tombol diklik; berisi seluruh jurnal sesuai filter.
+            st.download_button("📥 Excel", lambda q=SQL_JURNAL_EXPORT.format(filt=jurnal_filter_prefix(f_mode)): export_xlsx(db, q, sheet="Jurnal", money_cols=("nominal",)),
+                               "jurnal.xlsx", XLSX_MIME, key='btn_xls')
 
     if not df_j.empty:
         
+        profile_lap("render")
         html = """<table class="journal-table"><thead><tr><th width="15%">Tanggal</th><th width="45%">Akun & Keterangan</th><th width="10%">Ref</th><th width="15%" style="text-align:right">Debit</th><th width="15%" style="text-align:right">Kredit</th></tr></thead><tbody>"""
         for _, r in df_j.iterrows():
             nom = f"Rp {r['nominal']:,.0f}"
             html += f"""<tr><td style="border:none; font-weight:bold;">{r['tanggal']}</td><td style="border:none;" class="acc-db">{r['akun_debit']}</td><td style="border:none;"><span class="tag-db">Debit</span></td><td style="border:none;" class="money">{nom}</td><td style="border:none;"></td></tr>
                         <tr><td style="font-size:11px; color:#999;">ID: {r['id']}</td><td class="acc-cr">↳ {r['akun_kredit']} <br><span style="font-size:12px; color:#888;">Note: {r['deskripsi']}</span></td><td><span class="tag-cr">Kredit</span></td><td></td><td class="money">{nom}</td></tr>"""
+        profile_lap("compute")
         st.markdown(html+"</tbody></table>", unsafe_allow_html=True)
         
         
@@ -1036,26 +2936,20 @@ def page_jurnal():
 
                 if st.button("🚀 Eksekusi Hapus & Koreksi", type="primary"):
                     
-                    cek = db.get_one("SELECT * FROM jurnal WHERE id=?", (del_id,))
-                    if not cek:
-                        st.error("ID Transaksi tidak ditemukan!")
+                    restore = is_stok_trx and kode_brg_restore and qty_restore > 0
+                    try:
+                        posting.post(DeleteJurnalEvent(jurnal_id=del_id, user=st.session_state['username'],
+                                                       kode_barang=kode_brg_restore if restore else None,
+                                                       qty=qty_restore if restore else 0, jenis_koreksi=jenis_koreksi))
+                    except PostingError as e:
+                        st.error(str(e))
                     else:
-                        
-                        db.run_query("DELETE FROM jurnal WHERE id=?", (del_id,))
                         msg = f"Jurnal ID {del_id} berhasil dihapus."
-                        
-                        
-                        if is_stok_trx and kode_brg_restore and qty_restore > 0:
+                        if restore:
                             if jenis_koreksi == "IN":
-                                db.run_query("UPDATE inventory SET stok_saat_ini=stok_saat_ini+? WHERE kode_barang=?", (qty_restore, kode_brg_restore))
                                 msg += f" Dan Stok {pilih_brg} dikembalikan (+{qty_restore})."
                             else:
-                                db.run_query("UPDATE inventory SET stok_saat_ini=stok_saat_ini-? WHERE kode_barang=?", (qty_restore, kode_brg_restore))
                                 msg += f" Dan Stok {pilih_brg} dibatalkan (-{qty_restore})."
-                            
-                           
-                            db.run_query("INSERT INTO stock_log (tanggal, kode_barang, jenis_gerak, jumlah, harga_satuan, keterangan, user) VALUES (?,?,?,?,?,?,?)", 
-                                        (date.today(), kode_brg_restore, jenis_koreksi, qty_restore, 0, f"Koreksi Hapus ID {del_id}", st.session_state['username']))
 
                         st.success(msg)
                         time.sleep(2)
@@ -1063,53 +2957,97 @@ def page_jurnal():
     else:
         st.info("Data tidak ditemukan untuk kategori ini.")
 
-
-def generate_gl_rows(df, acc_name, is_normal_debit):
-    rows_html = ""
-    running_balance = 0
-    total_debit = 0
-    total_kredit = 0
-
-    for _, r in df.iterrows():
-        if r['akun_debit'] == acc_name:
-            mut_debit = r['nominal']
-            mut_kredit = 0
-            ref = "DB"
-        else:
-            mut_debit = 0
-            mut_kredit = r['nominal']
-            ref = "CR"
-        
-        if is_normal_debit:
-            running_balance += (mut_debit - mut_kredit)
+    with st.expander("🖨️ Cetak Kwitansi Massal"):
+        mode = st.radio("Pilih Transaksi", ["Rentang Tanggal", "Daftar ID"], horizontal=True, key="kw_mode")
+        df_kw = pd.DataFrame()
+        if mode == "Rentang Tanggal":
+            k1, k2, k3 = st.columns(3)
+            kw_dari = k1.date_input("Dari", date.today(), key="kw_dari")
+            kw_sampai = k2.date_input("Sampai", date.today(), key="kw_sampai")
+            kw_filter = k3.selectbox("Kategori", list(JURNAL_FILTERS), index=1, key="kw_filter")
+            df_kw = db.get_receipts(kw_dari, kw_sampai, kw_filter)
         else:
-            running_balance += (mut_kredit - mut_debit)
-        
-        total_debit += mut_debit
-        total_kredit += mut_kredit
+            try:
+                kw_ids = parse_id_list(st.text_input("ID Jurnal", placeholder="Contoh: 12, 15, 20-30", key="kw_ids"))
+                if kw_ids:
+                    df_kw = db.get_receipts(ids=kw_ids)
+            except ValueError as e:
+                st.error(str(e))
+        fmt = st.radio("Format", ["Satu PDF (multi-halaman)", "ZIP (PDF per transaksi)"], horizontal=True, key="kw_fmt")
+        as_zip = fmt.startswith("ZIP")
+        fname, mime = ("kwitansi.zip", "application/zip") if as_zip else ("kwitansi.pdf", "application/pdf")
+        st.caption(f"{len(df_kw):,} transaksi terpilih")
+
+        jobs = get_receipt_jobs()
+        job_id = st.session_state.get('kw_job')
+        job = jobs.status(job_id) if job_id else None
+        if job is not None:
+            if not job["future"].done():
+                receipt_job_progress(job)
+            elif job["future"].exception():
+                st.error(f"Gagal membuat kwitansi: {job['future'].exception()}")
+                if st.button("Tutup", key="kw_close"):
+                    jobs.discard(job_id); st.session_state.pop('kw_job', None); st.rerun()
+            else:
+                st.success(f"{job['total']:,} kwitansi siap.")
+                d1, d2 = st.columns(2)
+                d1.download_button("📥 Download", job["future"].result(), "kwitansi.zip" if job["as_zip"] else "kwitansi.pdf",
+                                   "application/zip" if job["as_zip"] else "application/pdf", key="kw_dl_job")
+                if d2.button("Selesai", key="kw_done"):
+                    jobs.discard(job_id); st.session_state.pop('kw_job', None); st.rerun()
+        elif len(df_kw) > RECEIPT_MAX:
+            st.error(f"Maksimal {RECEIPT_MAX:,} kwitansi sekali cetak; persempit rentang tanggal.")
+        elif len(df_kw) > RECEIPT_ASYNC_MIN:
+            if st.button("🖨️ Buat Kwitansi (di latar)", type="primary"):
+                st.session_state['kw_job'] = jobs.submit(df_kw, as_zip, get_receipt_logo())
+                log_activity(user_now, "CETAK_KWITANSI", f"{len(df_kw)} transaksi")
+                st.rerun()
+        elif not df_kw.empty:
+            # batch kecil: dibuat saat tombol diklik, seperti export Excel
+            logo = get_receipt_logo()
+            st.download_button("🖨️ Download Kwitansi", lambda df=df_kw: generate_receipts(df, as_zip, logo), fname, mime, key="kw_dl")
+
+
+GL_PAGE_SIZE = 100
+
+def compute_gl(df, acc_name, is_normal_debit, opening=0):
+    # Mutasi & saldo berjalan dihitung sekaligus (cumsum), tanpa loop per baris.
+    gl = df.copy() if not df.empty else pd.DataFrame(columns=["id", "tanggal", "deskripsi", "akun_debit", "nominal"])
+    is_db = gl['akun_debit'] == acc_name
+    gl['debit'] = gl['nominal'].where(is_db, 0)
+    gl['kredit'] = gl['nominal'].where(~is_db, 0)
+    gl['ref'] = is_db.map({True: "DB", False: "CR"})
+    mutasi = (gl['debit'] - gl['kredit']) if is_normal_debit else (gl['kredit'] - gl['debit'])
+    gl['saldo'] = opening + mutasi.cumsum()
+    return gl
+
+def gl_opening_row(tgl, label, saldo):
+    return f"""
+            <tr>
+                <td style="white-space:nowrap;">{tgl}</td>
+                <td><span style="font-weight:600; color:#374151;">{label}</span></td>
+                <td class="val-db">-</td><td class="val-cr">-</td>
+                <td class="val-bal">Rp {saldo:,.0f}</td>
+            </tr>"""
 
-        str_d = f"{mut_debit:,.0f}" if mut_debit > 0 else "-"
-        str_c = f"{mut_kredit:,.0f}" if mut_kredit > 0 else "-"
-        str_b = f"{running_balance:,.0f}"
-        
-        
-        rows_html += f"""
-        <tr>
-            <td style="white-space:nowrap;">{r['tanggal']}</td>
-            <td>
-                <span style="font-weight:600; color:#374151;">{r['deskripsi']}</span><br>
-                <span class="ref-badge">Ref: {ref}-{r['id']}</span>
-            </td>
-            <td class="val-db">{str_d}</td>
-            <td class="val-cr">{str_c}</td>
-            <td class="val-bal">Rp {str_b}</td>
-        </tr>
-        """
-    
-    return rows_html, total_debit, total_kredit, running_balance
+def render_gl_rows(gl):
+    return "".join(f"""
+            <tr>
+                <td style="white-space:nowrap;">{tgl}</td>
+                <td><span style="font-weight:600; color:#374151;">{desc}</span><br><span class="ref-badge">Ref: {ref}-{id_}</span></td>
+                <td class="val-db">{f"{d:,.0f}" if d else "-"}</td>
+                <td class="val-cr">{f"{k:,.0f}" if k else "-"}</td>
+                <td class="val-bal">Rp {bal:,.0f}</td>
+            </tr>""" for tgl, desc, ref, id_, d, k, bal in zip(gl['tanggal'], gl['deskripsi'], gl['ref'], gl['id'], gl['debit'], gl['kredit'], gl['saldo']))
+
+def generate_gl_rows(df, acc_name, is_normal_debit, opening=0):
+    gl = compute_gl(df, acc_name, is_normal_debit, opening)
+    running_balance = gl['saldo'].iloc[-1] if not gl.empty else opening
+    return render_gl_rows(gl), gl['debit'].sum(), gl['kredit'].sum(), running_balance
 
 
 @login_required
+@profiled
 def page_buku_besar():
     st.title("📖 General Ledger")
     
@@ -1145,77 +3083,77 @@ def page_buku_besar():
     with c1: acc_name = st.selectbox("Pilih Akun:", all_acc)
     
     
-    acc_data = db.get_df("SELECT * FROM akun WHERE nama_akun=?", (acc_name,)).iloc[0]
+    acc_data = db.get_akun(acc_name)
     is_debit = acc_data['tipe_akun'] in ['Aset', 'Beban']
     
     with c2: 
         st.markdown(f"<div style='margin-top:30px; text-align:center; font-weight:bold; color:#768209'>Saldo Normal: {'DEBIT' if is_debit else 'KREDIT'}</div>", unsafe_allow_html=True)
 
     
-    df = db.get_df("SELECT * FROM jurnal WHERE akun_debit=? OR akun_kredit=? ORDER BY tanggal ASC, id ASC", (acc_name, acc_name))
+    tgl_min, tgl_max = db.get_date_bounds()
+    awal_buka = db.get_open_period_start()
+    c3, c4 = st.columns(2)
+    dari = c3.date_input("Dari Tanggal", min(awal_buka, tgl_max) if awal_buka else tgl_min, key="gl_dari")
+    sampai = c4.date_input("Sampai Tanggal", tgl_max, key="gl_sampai")
+
+    profile_lap("render")
+    saldo_d, saldo_k = db.get_balance_before(acc_name, dari)
+    saldo_awal = (saldo_d - saldo_k) if is_debit else (saldo_k - saldo_d)
+    df = db.get_df_cached(SQL_LEDGER, (acc_name, dari, sampai, acc_name, dari, sampai, acc_name))
+    profile_lap("load")
+
+    gl = compute_gl(df, acc_name, is_debit, saldo_awal)
+    sum_d = gl['debit'].sum()
+    sum_k = gl['kredit'].sum()
+    # periode tanpa transaksi tetap menampilkan saldo awal (saldo yang dibawa dari periode sebelumnya)
+    run_bal = gl['saldo'].iloc[-1] if not gl.empty else saldo_awal
+
+    n_hal = max(1, -(-len(gl) // GL_PAGE_SIZE))
+    hal = n_hal
+    if n_hal > 1:
+        hal = st.number_input(f"Halaman (1 - {n_hal}, {len(gl):,} baris)", 1, n_hal, n_hal, key=f"gl_hal_{acc_name}_{dari}_{sampai}")
+    awal = (hal - 1) * GL_PAGE_SIZE
+
+    if awal:
+        rows_html = gl_opening_row(gl['tanggal'].iloc[awal], "Saldo Pindahan", gl['saldo'].iloc[awal - 1])
+    else:
+        rows_html = gl_opening_row(dari, "Saldo Awal Periode", saldo_awal)
+    rows_html += render_gl_rows(gl.iloc[awal:awal + GL_PAGE_SIZE])
 
-    if not df.empty:
-        
-        rows_html = ""
-        run_bal = 0
-        sum_d = 0
-        sum_k = 0
-        
-        for _, r in df.iterrows():
-            if r['akun_debit'] == acc_name:
-                d, k = r['nominal'], 0
-                ref = "DB"
-            else:
-                d, k = 0, r['nominal']
-                ref = "CR"
-            
-            if is_debit: run_bal += (d - k)
-            else: run_bal += (k - d)
-            
-            sum_d += d; sum_k += k
-            
-            rows_html += f"""
+    
+    full_html = f"""
+    <table class="gl-table">
+        <thead>
             <tr>
-                <td style="white-space:nowrap;">{r['tanggal']}</td>
-                <td><span style="font-weight:600; color:#374151;">{r['deskripsi']}</span><br><span class="ref-badge">Ref: {ref}-{r['id']}</span></td>
-                <td class="val-db">{f"{d:,.0f}" if d else "-"}</td>
-                <td class="val-cr">{f"{k:,.0f}" if k else "-"}</td>
+                <th width="12%">Tanggal</th><th width="40%">Keterangan</th>
+                <th width="15%">Debit</th><th width="15%">Kredit</th><th width="18%">Saldo</th>
+            </tr>
+        </thead>
+        <tbody>{rows_html}</tbody>
+        <tfoot>
+            <tr style="background-color:#f4f6e6; font-weight:bold; border-top:2px solid #768209;">
+                <td colspan="2" style="text-align:right;">TOTAL:</td>
+                <td class="val-db">{sum_d:,.0f}</td>
+                <td class="val-cr">{sum_k:,.0f}</td>
                 <td class="val-bal">Rp {run_bal:,.0f}</td>
-            </tr>"""
-
-        
-        full_html = f"""
-        <table class="gl-table">
-            <thead>
-                <tr>
-                    <th width="12%">Tanggal</th><th width="40%">Keterangan</th>
-                    <th width="15%">Debit</th><th width="15%">Kredit</th><th width="18%">Saldo</th>
-                </tr>
-            </thead>
-            <tbody>{rows_html}</tbody>
-            <tfoot>
-                <tr style="background-color:#f4f6e6; font-weight:bold; border-top:2px solid #768209;">
-                    <td colspan="2" style="text-align:right;">TOTAL:</td>
-                    <td class="val-db">{sum_d:,.0f}</td>
-                    <td class="val-cr">{sum_k:,.0f}</td>
-                    <td class="val-bal">Rp {run_bal:,.0f}</td>
-                </tr>
-            </tfoot>
-        </table>
-        """
-        
-        st.markdown(full_html, unsafe_allow_html=True)
-        
-       
-        st.markdown("<br>", unsafe_allow_html=True)
-        b = io.BytesIO()
-        with pd.ExcelWriter(b, engine='xlsxwriter') as w: df.to_excel(w, index=False)
-        st.download_button("📥 Download Excel", b, "gl.xlsx")
-        
-    else:
-        st.info("Belum ada transaksi.")
+            </tr>
+        </tfoot>
+    </table>
+    """
+    profile_lap("compute")
+    
+    st.markdown(full_html, unsafe_allow_html=True)
+    if gl.empty:
+        st.info("Tidak ada transaksi pada periode ini.")
+    
+   
+    st.markdown("<br>", unsafe_allow_html=True)
+    gl_params = {"acc": acc_name, "dari": dari, "sampai": sampai, "awal": saldo_awal, "arah": 1 if is_debit else -1}
+    st.download_button("📥 Download Excel", lambda: export_xlsx(db, SQL_LEDGER_EXPORT, gl_params, sheet="Buku Besar", money_cols=("debit", "kredit", "saldo")),
+                       f"gl_{acc_name}.xlsx", XLSX_MIME)
 
 @login_required
+@profiled
 def page_laporan():
     st.title("📑 Financial Reports")
 
@@ -1285,66 +3223,67 @@ def page_laporan():
     st.markdown("""<div class="info-box">Laporan ini digenerate otomatis dari jurnal transaksi.</div>""", unsafe_allow_html=True)
 
     
-    df = db.get_df("SELECT * FROM jurnal")
-    if df.empty:
+    if not db.get_one(SQL_ADA_JURNAL):
         st.warning("Belum ada data.")
         return
 
     
-    df['nominal'] = pd.to_numeric(df['nominal'], errors='coerce').fillna(0)
+    tgl_min, tgl_max = db.get_date_bounds()
+    awal_buka = db.get_open_period_start()
+    c_dari, c_sampai = st.columns(2)
+    dari = c_dari.date_input("Dari Tanggal", min(awal_buka, tgl_max) if awal_buka else tgl_min, key="lap_dari")
+    sampai = c_sampai.date_input("Sampai Tanggal", tgl_max, key="lap_sampai")
+
+    # Neraca & posisi keuangan per tanggal akhir; laba rugi untuk mutasi periode.
+    if dari <= tgl_min and sampai >= tgl_max:
+        bal = bal_periode = db.get_account_balances()
+    else:
+        bal = db.get_account_balances(end=sampai)
+        bal_periode = db.get_account_balances(dari, sampai)
+    # Laba rugi tanpa jurnal penutup; tanpa tutup buku sama dengan bal_periode.
+    bal_lr = db.get_account_balances(dari, sampai, exclude_closing=True) if db.get_closing_dates() else bal_periode
+    profile_lap("load")
 
     
-    def get_total_html(tipe_list, normal_kredit=True):
-        acc_list = db.get_acc_by_type(tipe_list)
+    def get_total_html(tipe_list, normal_kredit=True, src=bal_lr):
         html_rows = ""
-        total_val = 0.0
+        total_val = 0
         
-        for ac in acc_list:
-            d = df[df['akun_debit'] == ac]['nominal'].sum()
-            k = df[df['akun_kredit'] == ac]['nominal'].sum()
-            
-            val = (k - d) if normal_kredit else (d - k)
+        for r in src[src['tipe_akun'].isin(tipe_list)].itertuples():
+            val = (r.kredit - r.debit) if normal_kredit else (r.debit - r.kredit)
             
             if val != 0:
                 total_val += val
                 txt_val = f"({abs(val):,.0f})" if val < 0 else f"{val:,.0f}"
-                html_rows += f"<tr><td class='indent'>{ac}</td><td class='money'>{txt_val}</td></tr>"
+                html_rows += f"<tr><td class='indent'>{r.nama_akun}</td><td class='money'>{txt_val}</td></tr>"
         
         return html_rows, total_val
 
+    rows_pdp, tot_pdp = get_total_html(['Pendapatan'], True)
+    rows_bbn, tot_bbn = get_total_html(['Beban', 'HPP'], False)
+    profile_lap("compute")
+
     
     t1, t2, t3 = st.tabs(["⚖️ Neraca Saldo", "📉 Laba Rugi", "🏛️ Posisi Keuangan"])
 
    
     with t1:
-        accs = db.get_df("SELECT kode_akun, nama_akun, tipe_akun FROM akun ORDER BY kode_akun")
-        rows = ""
-        tot_d = 0.0
-        tot_k = 0.0
+        net = bal['debit'].to_numpy(np.int64) - bal['kredit'].to_numpy(np.int64)
+        col_d = net.clip(min=0)
+        col_k = (-net).clip(min=0)
+        tot_d = int(col_d.sum())
+        tot_k = int(col_k.sum())
+        if tot_d != tot_k:
+            # Integer rupiah: selisih sekecil apa pun berarti ada jurnal ke akun di luar bagan akun.
+            st.warning(f"Neraca saldo tidak seimbang: selisih Rp {tot_d - tot_k:,}. Periksa akun jurnal yang tidak terdaftar di Master Akun.")
         
-        for _, r in accs.iterrows():
-            d_sum = df[df['akun_debit'] == r['nama_akun']]['nominal'].sum()
-            k_sum = df[df['akun_kredit'] == r['nama_akun']]['nominal'].sum()
-            
-            is_debit = r['tipe_akun'] in ["Aset", "Beban"] and "Akumulasi" not in r['nama_akun']
-            bal = d_sum - k_sum if is_debit else k_sum - d_sum
-            
-            vd = bal if is_debit and bal > 0 else 0
-            vk = bal if not is_debit and bal > 0 else 0
-            
-            if is_debit and bal < 0: vk = abs(bal); vd = 0
-            if not is_debit and bal < 0: vd = abs(bal); vk = 0
-            
-            tot_d += vd
-            tot_k += vk
-            
-            if bal != 0 or True:
-                rows += f"""<tr>
-                    <td style="width:15%">{r['kode_akun']}</td>
-                    <td style="width:45%">{r['nama_akun']}</td>
+        rows = "".join(f"""<tr>
+                    <td style="width:15%">{kode}</td>
+                    <td style="width:45%">{nama}</td>
                     <td class='money' style="width:20%">{f"{vd:,.0f}" if vd else "-"}</td>
                     <td class='money' style="width:20%">{f"{vk:,.0f}" if vk else "-"}</td>
-                </tr>"""
+                </tr>""" for kode, nama, vd, vk in zip(bal['kode_akun'], bal['nama_akun'], col_d, col_k))
+        profile_lap("compute")
         
         st.markdown(f"""
         <div style="overflow-x: auto;">
@@ -1367,10 +3306,6 @@ def page_laporan():
 
     
     with t2:
-        rows_pdp, tot_pdp = get_total_html(['Pendapatan'], True)
-        rows_bbn, tot_bbn = get_total_html(['Beban', 'HPP'], False) 
-        
-        
         laba = tot_pdp - tot_bbn
         color = "#166534" if laba >= 0 else "#991b1b"
 
@@ -1404,19 +3339,18 @@ def page_laporan():
 
    
     with t3:
-        _, t_p = get_total_html(['Pendapatan'], True)
-        _, t_b = get_total_html(['Beban', 'HPP'], False) 
-        profit_now = t_p - t_b
+        if bal is bal_lr:
+            profit_now = tot_pdp - tot_bbn
+        else:
+            profit_now = get_total_html(['Pendapatan'], True, bal)[1] - get_total_html(['Beban', 'HPP'], False, bal)[1]
         
         def get_bal_html(tipe, is_asset):
-            acc_list = db.get_acc_by_type([tipe])
             rows = ""
-            tot = 0.0
-            for ac in acc_list:
-                d = df[df['akun_debit'] == ac]['nominal'].sum()
-                k = df[df['akun_kredit'] == ac]['nominal'].sum()
+            tot = 0
+            for r in bal[bal['tipe_akun'] == tipe].itertuples():
+                ac, d, k = r.nama_akun, r.debit, r.kredit
                 
-                val = 0.0
+                val = 0
                 if "Akumulasi" in ac and is_asset: 
                     val = (k - d) 
                     tot -= val
@@ -1433,6 +3367,7 @@ def page_laporan():
         r_ast, t_ast = get_bal_html('Aset', True)
         r_liab, t_liab = get_bal_html('Kewajiban', False)
         r_mod, t_mod = get_bal_html('Modal', False)
+        profile_lap("compute")
         
         final_equity = t_mod + profit_now
 
@@ -1469,9 +3404,30 @@ def page_laporan():
 </table>
 </div>
 """, unsafe_allow_html=True)
+
+    with st.expander("🔒 Tutup Buku Periode"):
+        st.caption("Saldo Pendapatan & Beban s.d. tanggal tutup dipindah ke akun Modal, saldo akhir tiap akun disimpan "
+                   "sebagai saldo awal periode berikutnya, dan jurnal di periode tersebut dikunci dari perubahan & hapus/koreksi.")
+        tutup = db.get_df("""
+            SELECT p.sampai AS "Ditutup s.d.", a.nama_akun AS "Akun Modal", p.created_by AS "Oleh", p.created_at AS "Waktu"
+            FROM periode_tutup p LEFT JOIN akun a ON a.id = p.akun_modal_id ORDER BY p.sampai DESC
+        """)
+        if not tutup.empty:
+            st.dataframe(tutup, use_container_width=True, hide_index=True)
+        modal_opt = db.get_acc_by_type(['Modal'])
+        c_tgl, c_modal = st.columns(2)
+        tgl_tutup = c_tgl.date_input("Tutup s.d. tanggal", sampai, key="tutup_sampai")
+        akun_modal = c_modal.selectbox("Akun Modal", modal_opt, key="tutup_modal")
+        if st.button("🔒 Tutup Buku", type="primary", disabled=not modal_opt):
+            try:
+                posting.post(ClosingEvent(sampai=tgl_tutup, akun_modal=akun_modal, user=st.session_state['username']))
+                st.success(f"Periode s.d. {tgl_tutup} ditutup."); time.sleep(0.5); st.rerun()
+            except PostingError as e:
+                st.error(str(e))
             
 
 @login_required
+@profiled
 def page_master():
     st.title("🗂️ Master Data")
     
@@ -1483,7 +3439,7 @@ def page_master():
     """, unsafe_allow_html=True)
     
    
-    t_acc, t_inv, t_log, t_reset = st.tabs(["📂 Master Akun", "📦 Master Barang", "📜 System Logs", "⚠️ Factory Reset"])
+    t_acc, t_inv, t_log, t_perf, t_reset = st.tabs(["📂 Master Akun", "📦 Master Barang", "📜 System Logs", "⏱️ Performance", "⚠️ Factory Reset"])
 
     
     with t_acc:
@@ -1500,6 +3456,7 @@ def page_master():
                     if kd and nm:
                         try:
                             db.run_query("INSERT INTO akun (kode_akun, nama_akun, tipe_akun) VALUES (?,?,?)", (kd, nm, tp))
+                            db.coa.invalidate()
                             st.success(f"Berhasil!"); time.sleep(0.5); st.rerun()
                         except:
                             st.error("Kode/Nama sudah ada!")
@@ -1508,7 +3465,7 @@ def page_master():
 
         with col_view:
             st.write("##### 📋 Daftar Akun")
-            df_acc = db.get_df("SELECT kode_akun, nama_akun, tipe_akun FROM akun ORDER BY kode_akun")
+            df_acc = db.get_coa_df()[["kode_akun", "nama_akun", "tipe_akun"]]
             if not df_acc.empty:
                 st.dataframe(df_acc, use_container_width=True, hide_index=True, height=500)
                 st.markdown("---")
@@ -1517,8 +3474,21 @@ def page_master():
                     sel_del = st.selectbox("Pilih akun:", del_opt)
                     if st.button("Hapus Permanen", type="secondary"):
                         code_del = sel_del.split(" - ")[0]
-                        db.run_query("DELETE FROM akun WHERE kode_akun=?", (code_del,))
-                        st.warning("Dihapus."); time.sleep(0.5); st.rerun()
+                        if db.run_query("DELETE FROM akun WHERE kode_akun=?", (code_del,)):
+                            db.coa.invalidate()
+                            st.warning("Dihapus."); time.sleep(0.5); st.rerun()
+                with st.expander("✏️ Ubah Akun"):
+                    st.caption("Histori jurnal merujuk id akun, jadi nama baru langsung berlaku di semua transaksi lama.")
+                    tipe_opt = ["Aset", "Kewajiban", "Modal", "Pendapatan", "Beban"]
+                    sel_edit = st.selectbox("Pilih akun:", df_acc['kode_akun'] + " - " + df_acc['nama_akun'], key="edit_acc_sel")
+                    cur_acc = df_acc[df_acc['kode_akun'] == sel_edit.split(" - ")[0]].iloc[0]
+                    new_nm = st.text_input("Nama baru", value=cur_acc['nama_akun'], key=f"edit_acc_nm_{cur_acc['kode_akun']}")
+                    new_tp = st.selectbox("Tipe", tipe_opt, index=tipe_opt.index(cur_acc['tipe_akun']) if cur_acc['tipe_akun'] in tipe_opt else 0,
+                                          key=f"edit_acc_tp_{cur_acc['kode_akun']}")
+                    if st.button("Simpan Perubahan", key="edit_acc_btn"):
+                        if new_nm.strip() and db.run_query("UPDATE akun SET nama_akun=?, tipe_akun=? WHERE kode_akun=?", (new_nm.strip(), new_tp, cur_acc['kode_akun'])):
+                            db.coa.invalidate()
+                            st.success("Akun diperbarui."); time.sleep(0.5); st.rerun()
             else:
                 st.info("Data kosong.")
 
@@ -1575,7 +3545,7 @@ def page_master():
                         UPDATE inventory 
                         SET nama_barang=?, min_stok=?, std_cost=?, akun_aset=?, akun_hpp=? 
                         WHERE kode_barang=?
-                    """, (new_name, new_min, new_cost, new_acc_aset, new_acc_hpp, sel_inv_kode))
+                    """, (new_name, new_min, rupiah(new_cost), new_acc_aset, new_acc_hpp, sel_inv_kode))
                     
                     st.success(f"Data {new_name} berhasil diperbarui!")
                     time.sleep(1)
@@ -1584,18 +3554,82 @@ def page_master():
     
     with t_log:
         st.write("#### 📜 Aktivitas User")
-        df_log = db.get_df("SELECT * FROM stock_log ORDER BY tanggal DESC LIMIT 50")
+        df_log = db.get_df(SQL_STOCK_LOG_RECENT)
         st.dataframe(df_log, use_container_width=True)
 
-   
+        with st.expander("🔎 Audit Query Plan"):
+            df_plan = db.audit_query_plans()
+            if df_plan['full_scan'].any():
+                st.error("Ada query utama yang jatuh ke full table scan!")
+            else:
+                st.success("Semua query utama memakai index.")
+            st.dataframe(df_plan, use_container_width=True, hide_index=True)
+
+        with st.expander("🧮 Cek Konsistensi Saldo Akun"):
+            df_beda = db.check_account_balance()
+            if df_beda.empty:
+                st.success("Tabel saldo akun sesuai dengan jurnal.")
+            else:
+                st.error(f"{len(df_beda)} akun tidak sesuai dengan jurnal.")
+                st.dataframe(df_beda, use_container_width=True, hide_index=True)
+            if st.button("🔄 Rebuild Saldo & Rollup"):
+                db.rebuild_balances()
+                st.success("Saldo akun & rollup periode dihitung ulang."); time.sleep(0.5); st.rerun()
+
+    with t_perf:
+        st.caption("Statistik proses server saat ini (semua sesi), hilang saat aplikasi di-restart.")
+        df_top = db.stats.top_queries()
+        cs = db.cache.stats()
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Total Query", f"{int(df_top['count'].sum()) if not df_top.empty else 0:,}")
+        m2.metric("Query Lambat", len(db.stats.slow))
+        m3.metric("Cache Hit", f"{cs['hits']:,} / {cs['hits'] + cs['misses']:,}")
+        m4.metric("Cache", f"{cs['entries']} entri · {cs['bytes'] / 1e6:.1f} MB")
+
+        db.stats.threshold_ms = st.number_input("Batas query lambat (ms)", min_value=1.0, value=float(db.stats.threshold_ms), step=50.0)
+        st.write("#### 🐢 Query Terberat (total waktu)")
+        st.dataframe(df_top, use_container_width=True, hide_index=True)
+        st.write("#### 🧾 Query Lambat Terakhir")
+        st.dataframe(pd.DataFrame(list(db.stats.slow)[::-1], columns=["waktu", "ms", "halaman", "baris", "sql"]), use_container_width=True, hide_index=True)
+
+        c1, c2 = st.columns(2)
+        if c1.button("🔎 Audit Plan Query Terberat"):
+            df_plan = db.audit_query_plans(db.stats.plan_targets())
+            st.dataframe(df_plan, use_container_width=True, hide_index=True)
+        if c2.button("♻️ Reset Statistik"):
+            db.stats.reset(); profiler.reset(); st.rerun()
+
+        st.write("#### 🖥️ Waktu Render per Halaman")
+        st.caption(f"{profiler.window} render terakhir per bagian. Bagian: load (query), compute (pandas/HTML), render (widget & grafik), total.")
+        df_pg = profiler.summary()
+        st.dataframe(df_pg, use_container_width=True, hide_index=True)
+        if not df_pg.empty:
+            key = st.selectbox("Histogram", list(zip(df_pg['halaman'], df_pg['bagian'])), format_func=lambda k: f"{k[0]} · {k[1]}", key="perf_hist")
+            st.bar_chart(profiler.histogram(*key))
+
+        st.write("#### 🔬 cProfile")
+        if st.button("Profil Rerun Berikutnya"):
+            st.session_state['profile_next_rerun'] = True
+        if st.session_state.get('profile_next_rerun'):
+            st.info("Rerun berikutnya akan diprofil — buka halaman yang ingin diukur.")
+        for d in reversed(profiler.dumps):
+            with st.expander(f"{d['waktu']} · {d['halaman']} · {d['path']}"):
+                st.code(d['ringkasan'], language=None)
+                if os.path.exists(d['path']):
+                    with open(d['path'], "rb") as f:
+                        st.download_button("📥 .prof", f.read(), os.path.basename(d['path']), key=f"prof_{d['path']}")
+
     with t_reset:
         st.error("⚠️ **ZONA BAHAYA**")
         st.write("Menghapus SEMUA transaksi (Jurnal & Stok). Data Master aman.")
         if st.button("🔥 RESET DATA TRANSAKSI", type="primary"):
-            db.run_query("DELETE FROM jurnal")
-            db.run_query("DELETE FROM stock_log")
-            db.run_query("UPDATE inventory SET stok_saat_ini = 0")
-            st.success("Reset Berhasil!"); time.sleep(1); st.rerun()
+            try:
+                posting.post(ResetTransaksiEvent(user=st.session_state['username']))
+            except Exception as e:
+                st.error(f"Reset dibatalkan, data tidak berubah: {e}")
+            else:
+                log_activity(st.session_state['username'], "RESET", "Semua transaksi dihapus")
+                st.success("Reset Berhasil!"); time.sleep(1); st.rerun()
 
 def login_page():
 
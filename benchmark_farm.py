@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Generator data sintetis peternakan puyuh + benchmark jalur berat aplikasi.
+# Contoh:
+#   python benchmark_farm.py --tahun 5 --seed 7 --baru
+#   python benchmark_farm.py --tanpa-generate --baseline bench_results_lama.json
+
+parser = argparse.ArgumentParser(description="Data sintetis Hasna Farm + benchmark")
+parser.add_argument("--db", default="bench_farm.db", help="file database sintetis (jangan arahkan ke data asli)")
+parser.add_argument("--out", default="bench_results.json", help="file hasil (JSON)")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--tahun", type=int, default=3, help="lama aktivitas harian yang dibuat")
+parser.add_argument("--mulai", default="2022-01-01", help="tanggal transaksi pertama (YYYY-MM-DD)")
+parser.add_argument("--skala", type=float, default=1.0, help="pengali volume penjualan & produksi harian")
+parser.add_argument("--ulang", type=int, default=5, help="jumlah pengulangan tiap benchmark")
+parser.add_argument("--baru", action="store_true", help="hapus database lama sebelum generate")
+parser.add_argument("--tanpa-generate", action="store_true", help="pakai database yang sudah ada")
+parser.add_argument("--tutup-buku", action="store_true", help="tutup buku tiap akhir tahun saat generate")
+parser.add_argument("--tanpa-halaman", action="store_true", help="lewati benchmark render halaman (AppTest)")
+parser.add_argument("--baseline", help="hasil JSON versi sebelumnya untuk dibandingkan")
+parser.add_argument("--toleransi", type=float, default=0.2, help="batas kenaikan median sebelum dianggap regresi")
+args = parser.parse_args()
+
+if os.path.abspath(args.db) == os.path.abspath("hasna_real_data.db"):
+    sys.exit("Jangan jalankan benchmark di hasna_real_data.db.")
+if args.baru:
+    for ext in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + ext):
+            os.remove(args.db + ext)
+
+# Harus diset sebelum import: modul aplikasi membuka database saat di-import.
+os.environ["HASNA_DB_PATH"] = args.db
+import app_akuntansi as app
+
+USER = "bench"
+BATCH_HARI = 31
+BATAS_HUTANG = 50_000_000
+
+
+def generate(db, posting, rng, mulai, hari, skala, tutup_buku=False):
+    # Aktivitas harian: produksi (pakan -> telur/pupuk) & jual (+HPP), beli pakan, biaya rutin, pelunasan hutang/piutang.
+    # Kas & hutang dilacak di sini: pengeluaran tunai hanya selama kas cukup, sisanya hutang sampai BATAS_HUTANG.
+    inv = db.get_df("SELECT kode_barang, nama_barang, std_cost, stok_saat_ini FROM inventory").set_index("kode_barang")
+    nama = inv["nama_barang"].to_dict()
+    stok = {k: float(v or 0) for k, v in inv["stok_saat_ini"].items()}
+    std = {k: float(v or 0) for k, v in inv["std_cost"].items()}
+    nilai = {k: stok[k] * std[k] for k in stok}  # nilai persediaan per barang, sesuai jurnal
+    kas, hutang, piutang = 250_000_000, 0, 0
+
+    events = [
+        app.OpeningBalanceEvent(tanggal=mulai, deskripsi="Saldo Awal Kas", akun="Kas", posisi="Debit", nominal=kas, user=USER),
+        app.OpeningBalanceEvent(tanggal=mulai, deskripsi="Saldo Awal Kandang", akun="Bangunan Kandang", posisi="Debit", nominal=30_000_000, user=USER),
+        app.OpeningBalanceEvent(tanggal=mulai, deskripsi="Saldo Awal Kendaraan", akun="Kendaraan", posisi="Debit", nominal=140_000_000, user=USER),
+        app.OpeningBalanceEvent(tanggal=mulai, deskripsi="Saldo Awal Modal", akun="Modal Pemilik", posisi="Kredit", nominal=420_000_000, user=USER),
+    ]
+
+    def bayar(nominal, hutang_dulu=False, boleh_hutang=True):
+        # Akun kredit untuk pengeluaran; None = dibatalkan (kas kurang & batas hutang penuh).
+        nonlocal kas, hutang
+        bisa_hutang = boleh_hutang and hutang + nominal <= BATAS_HUTANG
+        if kas >= nominal and not (hutang_dulu and bisa_hutang):
+            kas -= nominal
+            return "Kas"
+        if bisa_hutang:
+            hutang += nominal
+            return "Hutang Usaha"
+        return None
+
+    def beli(tgl, kode, qty, harga, ket, hutang_dulu=False):
+        total = round(qty * harga)
+        akun_kredit = bayar(total, hutang_dulu)
+        if not akun_kredit:
+            return
+        stok[kode] += qty
+        nilai[kode] += total
+        events.append(app.PurchaseEvent(tanggal=tgl, kode_barang=kode, nama_barang=nama[kode], qty=qty, total=total,
+                                        keterangan=ket, akun_kredit=akun_kredit, user=USER))
+
+    def jual(tgl, kode, qty, harga, akun_kredit, ket):
+        nonlocal kas, piutang
+        qty = min(qty, stok[kode])
+        if qty <= 0:
+            return
+        stok[kode] -= qty
+        akun_debit = "Kas" if rng.random() < 0.8 else "Piutang Dagang"
+        if akun_debit == "Piutang Dagang":
+            piutang += round(qty * harga)
+        else:
+            kas += round(qty * harga)
+        events.append(app.SaleEvent(tanggal=tgl, kode_barang=kode, nama_barang=nama[kode], qty=qty, harga=harga,
+                                    keterangan=ket, akun_debit=akun_debit, akun_kredit=akun_kredit, user=USER))
+
+    def produksi(tgl, kode, qty, ket):
+        # Aplikasi belum punya event produksi: hasil dicatat sebagai barang masuk senilai harga standarnya,
+        # dibayar dari Persediaan Pakan Ternak (nilai pakan pindah ke persediaan hasil). Seperti vitamin di
+        # bawah, qty pakan yang terpakai tidak tercatat di kartu stok; yang dilacak nilai pakan di akun.
+        pakan = max(("PKN-MERAH", "PKN-BIRU"), key=nilai.get)
+        qty = min(qty, int(nilai[pakan] // std[kode]))
+        if qty <= 0:
+            return
+        stok[kode] += qty
+        nilai[pakan] -= qty * std[kode]
+        events.append(app.PurchaseEvent(tanggal=tgl, kode_barang=kode, nama_barang=nama[kode], qty=qty, total=qty * std[kode],
+                                        keterangan=ket, deskripsi=f"PRODUKSI {nama[kode]}: {ket}",
+                                        akun_kredit="Persediaan Pakan Ternak", user=USER))
+
+    def biaya(tgl, desk, debit, kredit, nominal):
+        if kredit:
+            events.append(app.ExpenseEvent(tanggal=tgl, deskripsi=desk, akun_debit=debit, akun_kredit=kredit, nominal=round(nominal), user=USER))
+
+    for i in range(hari):
+        tgl = mulai + timedelta(days=i)
+        if i % 3 == 0:
+            kode = rng.choice(("PKN-MERAH", "PKN-BIRU"))
+            beli(tgl, kode, round(rng.randint(5, 7) * skala), std[kode] * rng.uniform(0.95, 1.08), "Pakan mingguan",
+                 hutang_dulu=rng.random() < 0.3)
+        produksi(tgl, "TELUR", max(1, round(rng.randint(6, 10) * skala)), "Produksi harian")
+        for n in range(max(1, round(rng.randint(1, 3) * skala))):
+            jual(tgl, "TELUR", rng.randint(2, 6), rng.choice((300_000, 310_000, 320_000, 335_000)), "Penjualan Telur Puyuh", f"Pelanggan {rng.randint(1, 60)}")
+        if tgl.weekday() == 0:
+            produksi(tgl, "PUPUK", rng.randint(8, 15), "Kotoran terkumpul")
+            ongkos = rng.randint(50, 150) * 1000
+            biaya(tgl, "Ongkos kirim telur", "Beban Transportasi", bayar(ongkos), ongkos)
+        if tgl.weekday() == 5:
+            jual(tgl, "PUPUK", rng.randint(5, 15), rng.choice((8_000, 10_000, 12_000)), "Penjualan Kotoran (Pupuk)", "Pupuk organik")
+        if tgl.day == 5:
+            beli(tgl, "VIT-OBAT", rng.randint(1, 3), std["VIT-OBAT"] * rng.uniform(0.9, 1.1), "Vitamin bulanan")
+        if tgl.day == 20 and stok["VIT-OBAT"] > 0:
+            pakai = min(stok["VIT-OBAT"], rng.randint(1, 2))
+            beban = round(nilai["VIT-OBAT"] * pakai / stok["VIT-OBAT"])
+            stok["VIT-OBAT"] -= pakai
+            nilai["VIT-OBAT"] -= beban
+            biaya(tgl, "Pemakaian vitamin & obat", "Beban Obat & Vitamin", "Persediaan Obat & Vitamin", beban)
+        if tgl.day == 25:
+            listrik = rng.randint(250, 450) * 1000
+            biaya(tgl, "Tagihan listrik & air", "Beban Listrik, Air, dan Telepon", bayar(listrik), listrik)
+            biaya(tgl, "Penyusutan kandang", "Beban Penyusutan Kandang", "Akumulasi Penyusutan Kandang", 150_000)
+            biaya(tgl, "Penyusutan kendaraan", "Beban Penyusutan Kendaraan", "Akumulasi Penyusutan Kendaraan", 413_194)
+            if rng.random() < 0.3:
+                prive = rng.randint(1, 4) * 500_000
+                biaya(tgl, "Ambil prive pemilik", "Prive", bayar(prive, boleh_hutang=False), prive)
+        if tgl.day == 28:
+            if piutang:
+                biaya(tgl, "Pelunasan piutang pelanggan", "Kas", "Piutang Dagang", piutang)
+                kas += piutang
+                piutang = 0
+            lunas = min(hutang, kas)
+            if lunas:
+                biaya(tgl, "Pelunasan hutang usaha", "Hutang Usaha", "Kas", lunas)
+                kas -= lunas
+                hutang -= lunas
+
+        # Commit per ~bulan: satu transaksi berisi semua event periode itu.
+        akhir = i == hari - 1
+        tutup = tutup_buku and not akhir and (tgl + timedelta(days=1)).year != tgl.year
+        if (i + 1) % BATCH_HARI == 0 or akhir or tutup:
+            posting.post(events)
+            events = []
+        if tutup:
+            posting.post(app.ClosingEvent(sampai=tgl, akun_modal="Modal Pemilik", user=USER))
+
+
+def timed(fn, ulang, clear_cache=True):
+    hasil = []
+    for _ in range(ulang):
+        if clear_cache:
+            app.db.cache.clear()
+        t0 = time.perf_counter()
+        fn()
+        hasil.append((time.perf_counter() - t0) * 1000)
+    return {"runs": ulang, "min_ms": round(min(hasil), 3), "median_ms": round(statistics.median(hasil), 3), "max_ms": round(max(hasil), 3)}
+
+
+def run_page(page):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_string(f"""
+import streamlit as st
+st.session_state['logged_in'] = True
+st.session_state['username'] = 'admin'
+st.session_state['role'] = 'Manager'
+import app_akuntansi as a
+a.{page}()
+""", default_timeout=600)
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{page}: {at.exception[0].value}")
+
+
+def benchmarks(db, lo, hi):
+    awal_tahun = date(hi.year, 1, 1)
+
+    def laporan():
+        db.get_account_balances(end=hi)
+        db.get_account_balances(awal_tahun, hi)
+        db.get_account_balances(awal_tahun, hi, exclude_closing=True)
+
+    def buku_besar(akun):
+        def run():
+            acc = db.get_akun(akun)
+            is_debit = acc['tipe_akun'] in ['Aset', 'Beban']
+            sd, sk = db.get_balance_before(akun, lo)
+            saldo_awal = (sd - sk) if is_debit else (sk - sd)
+            df = db.get_df_cached(app.SQL_LEDGER, (akun, lo, hi, akun, lo, hi, akun))
+            gl = app.compute_gl(df, akun, is_debit, saldo_awal)
+            app.render_gl_rows(gl.iloc[-app.GL_PAGE_SIZE:])
+        return run
+
+    def dashboard():
+        db.get_account_balances()
+        for g in app.ROLLUP_GRAINS:
+            db.get_cashflow_series(g)
+        db.get_expense_composition()
+        db.count_low_stock()
+
+    def ekspor_buku_besar():
+        app.export_xlsx(db, app.SQL_LEDGER_EXPORT, {"acc": "Kas", "dari": lo, "sampai": hi, "awal": 0, "arah": 1},
+                        sheet="Buku Besar", money_cols=("debit", "kredit", "saldo"))
+
+    daftar = {
+        "laporan_saldo": laporan,
+        "buku_besar_kas": buku_besar("Kas"),
+        "buku_besar_penjualan_telur": buku_besar("Penjualan Telur Puyuh"),
+        "kartu_stok_telur_standard": lambda: db.get_inventory_card_df("TELUR", "standard"),
+        "kartu_stok_telur_average": lambda: db.get_inventory_card_df("TELUR", "average"),
+        "dashboard_agregasi": dashboard,
+        "ekspor_jurnal_xlsx": lambda: app.export_xlsx(db, "SELECT * FROM jurnal ORDER BY tanggal, id", (), "Jurnal", money_cols=("nominal",)),
+        "ekspor_buku_besar_xlsx": ekspor_buku_besar,
+    }
+    hasil = {}
+    for nama, fn in daftar.items():
+        hasil[nama] = timed(fn, args.ulang)
+        print(f"  {nama:32s} median {hasil[nama]['median_ms']:10.1f} ms")
+    if not args.tanpa_halaman:
+        for page in ("page_laporan", "page_buku_besar", "page_dashboard", "page_jurnal"):
+            nama = f"halaman_{page[5:]}"
+            hasil[nama] = timed(lambda: run_page(page), args.ulang)
+            print(f"  {nama:32s} median {hasil[nama]['median_ms']:10.1f} ms")
+
+    hasil.update(bench_posting(hi + timedelta(days=1)))
+    return hasil
+
+
+def bench_posting(tgl):
+    # Posting ditulis ke salinan sementara: database benchmark tetap sama untuk run berikutnya.
+    hasil = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        salinan = os.path.join(tmp, "posting.db")
+        with sqlite3.connect(args.db) as src, sqlite3.connect(salinan) as dst:
+            src.backup(dst)
+        posting = app.PostingService(app.DatabaseManager(salinan))
+        ev = lambda i: app.ExpenseEvent(tanggal=tgl, deskripsi=f"Benchmark posting {i}", akun_debit="Beban Transportasi",
+                                        akun_kredit="Kas", nominal=1000 + i, user=USER)
+        n_satuan, n_batch = 200, 2000
+        t0 = time.perf_counter()
+        for i in range(n_satuan):
+            posting.post(ev(i))
+        dt = time.perf_counter() - t0
+        hasil["posting_satuan"] = {"runs": n_satuan, "total_ms": round(dt * 1000, 3), "per_second": round(n_satuan / dt, 1)}
+        t0 = time.perf_counter()
+        posting.post([ev(i) for i in range(n_batch)])
+        dt = time.perf_counter() - t0
+        hasil["posting_batch"] = {"runs": n_batch, "total_ms": round(dt * 1000, 3), "per_second": round(n_batch / dt, 1)}
+        posting.db.pool.close_all()
+    for nama in ("posting_satuan", "posting_batch"):
+        print(f"  {nama:32s} {hasil[nama]['per_second']:10.1f} event/detik")
+    return hasil
+
+
+def compare(out, baseline_file, toleransi):
+    with open(baseline_file, encoding="utf-8") as f:
+        base = json.load(f)
+    lama, hasil = base["results"], out["results"]
+    regresi = []
+    print(f"\nBanding dengan {baseline_file} (versi {base['meta'].get('version')}):")
+    beda = [k for k in ("rows", "seed", "years", "start", "scale", "closing") if base["meta"].get(k) != out["meta"].get(k)]
+    if beda:
+        print(f"  PERINGATAN: data sintetis berbeda ({', '.join(beda)}), rasio tidak sebanding.")
+    for nama, r in hasil.items():
+        if nama not in lama:
+            continue
+        if "median_ms" in r:
+            rasio = r["median_ms"] / max(lama[nama]["median_ms"], 1e-9)
+        else:
+            rasio = lama[nama]["per_second"] / max(r["per_second"], 1e-9)
+        tanda = "REGRESI" if rasio > 1 + toleransi else ""
+        if tanda:
+            regresi.append(nama)
+        print(f"  {nama:32s} x{rasio:6.2f} {tanda}")
+    return regresi
+
+
+def main():
+    db, posting = app.db, app.posting
+    rng = random.Random(args.seed)
+    mulai = date.fromisoformat(args.mulai)
+    hari = 365 * args.tahun + args.tahun // 4
+
+    if not args.tanpa_generate:
+        if db.get_one(app.SQL_ADA_JURNAL):
+            sys.exit(f"{args.db} sudah berisi jurnal; pakai --baru atau --tanpa-generate.")
+        t0 = time.perf_counter()
+        generate(db, posting, rng, mulai, hari, args.skala, args.tutup_buku)
+        print(f"Generate {hari} hari selesai dalam {time.perf_counter() - t0:.1f} s")
+
+    baris = {t: db.get_one(f"SELECT COUNT(*) FROM {t}")[0] for t in ("jurnal_data", "stock_log", "inventory", "akun")}
+    print("Baris:", baris)
+    lo, hi = db.get_date_bounds()
+    hi = date.fromisoformat(db.get_one(app.SQL_DATE_MAX)[0][:10])
+
+    hasil = benchmarks(db, lo, hi)
+    try:
+        versi = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        versi = None
+    out = {
+        "meta": {
+            "version": versi, "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "db": args.db, "rows": baris,
+        },
+        "results": hasil,
+    }
+    if not args.tanpa_generate:
+        out["meta"].update(seed=args.seed, years=args.tahun, start=args.mulai, scale=args.skala, closing=args.tutup_buku)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"Hasil ditulis ke {args.out}")
+
+    if args.baseline and compare(out, args.baseline, args.toleransi):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
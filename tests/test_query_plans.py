@@ -0,0 +1,103 @@
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# import app_akuntansi langsung memigrasi HASNA_DB_PATH; jangan sampai menyentuh database asli
+os.environ["HASNA_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "import.db")
+import app_akuntansi as app  # noqa: E402
+
+# Template {filt} dipakai dengan setiap filter jenis di halaman jurnal.
+KEYSET_SQL = ("SQL_JURNAL_PAGE", "SQL_JURNAL_NEWER", "SQL_JURNAL_EXPORT", "SQL_RECEIPTS_RANGE")
+# Versi *_NAMA hanya jalan di migrasi sebelum migration_akun_id, saat `jurnal` masih tabel.
+LEGACY_UNTIL = app.MIGRATIONS.index(app.migration_akun_id)
+
+
+def sql_constants():
+    for name in sorted(vars(app)):
+        q = getattr(app, name)
+        if not name.startswith("SQL_") or not isinstance(q, str) or q.lstrip().upper().startswith("CREATE"):
+            continue
+        if "{filt}" in q:
+            for f in app.JURNAL_FILTERS:
+                yield f"{name}[{f}]", q.format(filt=app.jurnal_filter_prefix(f))
+        elif "{fts}" in q:
+            for fts, _, _ in app.FTS_INDEXES:
+                yield f"{name}[{fts}]", q.format(fts=fts)
+        elif "{op}" not in q:  # SQL_BALANCES_ASOF: dipakai lewat SQL_BALANCES_UNTIL/BEFORE
+            yield name, q
+    for name, (q, _) in app.HOT_QUERIES.items():
+        yield f"HOT_QUERIES[{name}]", q
+
+
+QUERIES = dict(sql_constants())
+
+
+def null_params(q):
+    # EXPLAIN tidak menjalankan query: cukup NULL untuk tiap placeholder (di luar literal string).
+    body = re.sub(r"'(?:[^']|'')*'", "''", q)
+    names = re.findall(r":(\w+)", body)
+    return {n: None for n in names} if names else (None,) * body.count("?")
+
+
+def migrated_db(path, steps):
+    # Database baru lewat jalur yang sama dengan init_db: migrasi berurutan, satu transaksi.
+    c = sqlite3.connect(path, isolation_level=None)
+    c.row_factory = sqlite3.Row
+    c.execute("BEGIN IMMEDIATE")
+    for num, step in enumerate(steps, start=1):
+        step(c)
+        c.execute(f"PRAGMA user_version = {num}")
+    c.execute("COMMIT")
+    return c
+
+
+@pytest.fixture(scope="module")
+def conn(tmp_path_factory):
+    c = migrated_db(tmp_path_factory.mktemp("plan") / "fresh.db", app.MIGRATIONS)
+    yield c
+    c.close()
+
+
+@pytest.fixture(scope="module")
+def legacy_conn(tmp_path_factory):
+    c = migrated_db(tmp_path_factory.mktemp("plan") / "legacy.db", app.MIGRATIONS[:LEGACY_UNTIL])
+    yield c
+    c.close()
+
+
+def plan(conn, q):
+    return [r["detail"] for r in conn.execute("EXPLAIN QUERY PLAN " + q, null_params(q))]
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_no_full_table_scan(request, name):
+    c = request.getfixturevalue("legacy_conn" if name.endswith("_NAMA") else "conn")
+    p = plan(c, QUERIES[name])
+    assert not app.full_scans(p, QUERIES[name]), " | ".join(p)
+
+
+@pytest.mark.parametrize("name", [n for n in QUERIES if n.split("[")[0] in KEYSET_SQL])
+def test_keyset_order_from_index(conn, name):
+    # Kursor keyset & ekspor per chunk hanya murah bila urutan (tanggal, id) datang dari index.
+    p = plan(conn, QUERIES[name])
+    assert "USE TEMP B-TREE FOR ORDER BY" not in p, " | ".join(p)
+
+
+def test_full_scans_rule():
+    assert app.full_scans(["SCAN jurnal_data"])
+    assert app.full_scans(["SCAN a", "SEARCH j USING INDEX idx_jurnal_jenis (jenis=?)"])
+    # walk index penuh tetap membaca semua baris, kecuali dibatasi LIMIT tanpa sort tambahan
+    walk = ["SCAN jurnal_data USING COVERING INDEX idx_jurnal_tanggal"]
+    assert app.full_scans(walk, "SELECT tanggal FROM jurnal_data ORDER BY tanggal")
+    assert not app.full_scans(walk, "SELECT tanggal FROM jurnal_data ORDER BY tanggal LIMIT ? OFFSET ?")
+    assert app.full_scans(walk + ["USE TEMP B-TREE FOR ORDER BY"], "SELECT * FROM jurnal_data ORDER BY nominal LIMIT 5")
+    assert app.full_scans(["SCAN inventory"], "SELECT * FROM inventory LIMIT 1")
+    assert not app.full_scans(["SCAN a", "SEARCH b USING INDEX sqlite_autoindex_account_balance_1 (akun_id=?)"],
+                              app.SQL_ACCOUNT_BALANCES)
+    assert not app.full_scans(["CO-ROUTINE j", "SCAN j", "SCAN (subquery-2)", "SCAN CONSTANT ROW"])
+    assert not app.full_scans(["SCAN f VIRTUAL TABLE INDEX 0:M1", "SCAN json_each VIRTUAL TABLE INDEX 1:"])